@@ -0,0 +1,228 @@
+"""
+
+@author: John Wainwright
+Skipping dormant cells during dry periods
+In long continuous runs most cells spend most of the time with no rain and
+no runon, doing nothing but drain slowly. With no inflow except a steady
+subsurface inflow q from upslope, the soil moisture of a cell follows
+    dsoilMoist/dt = q - k exp ((soilMoist - satSoilMoist) / transmissivity)
+with k = satInfilt (sin (slope) + cos (slope)), which has the closed-form
+solution (writing x = exp ((soilMoist - satSoilMoist) / transmissivity))
+    x (t) = q x0 / (k x0 + (q - k x0) exp (-q t / transmissivity))
+or x0 / (1 + k x0 t / transmissivity) when q is zero. A cell becomes
+dormant once it has no rain, no runon and no overland flow, its subsurface
+flow and drainage have fallen below threshold and every cell upslope of it
+is dormant too. Dormant cells are left alone and only brought up to date
+with the closed-form solution when something needs them - rain falls on
+them, an upslope cell wakes up, an active cell downslope needs their
+subsurface flow, or Synchronize is called before reading results - so each
+step costs time in proportion to the number of active cells. The
+threshold sets the approximation: below it the subsurface inflow of a
+dormant cell is taken to stay at the value it had when the cell went
+dormant
+
+Variables:
+    grid                leakyBucketGrid holding the landscape
+    network             routingNetwork linking the cells
+    threshold           subsurface flow plus drainage (mm/h) below which a
+                        cell with no inflow may become dormant
+    time                simulation time in h
+    active              cells active after the last step
+    isDormant           whether each cell is dormant
+    dormantTime         time in h to which the state of each dormant cell
+                        is up to date
+    dormantInflow       subsurface inflow (mm/h) assumed for each dormant cell
+    nCellUpdates        number of cell updates made by the explicit scheme
+
+"""
+
+import numpy as np
+
+import instrumentation
+
+
+class activeScheduler:
+    def __init__ (self, grid, network, threshold = 0.01):
+        self.grid = grid
+        self.network = network
+        self.threshold = threshold
+        self.time = 0.
+        self.active = network.order.copy ()
+        self.isDormant = np.zeros (grid.nCells, dtype = bool)
+        self.dormantTime = np.zeros (grid.nCells)
+        self.dormantInflow = np.zeros (grid.nCells)
+        self.nCellUpdates = 0
+
+    def _CatchUp (self, cells, toTime):
+        #bring dormant cells up to date with the closed-form solution
+        if cells.size == 0:
+            return
+        grid = self.grid
+        elapsed = toTime - self.dormantTime [cells]
+        cells = cells [elapsed > 0.]
+        if cells.size == 0:
+            return
+        elapsed = elapsed [elapsed > 0.]
+        satSoilMoist = grid.satSoilMoist [cells]
+        transmissivity = grid.transmissivity [cells]
+        sinSlope = np.sin (grid.slope [cells])
+        cosSlope = np.cos (grid.slope [cells])
+        k = grid.satInfilt [cells] * (sinSlope + cosSlope)
+        inflow = self.dormantInflow [cells]
+        soilMoist = grid.soilMoist [cells]
+        x0 = np.exp ((soilMoist - satSoilMoist) / transmissivity)
+        #written as x0 / (exp (-q t / T) + k x0 (1 - exp (-q t / T)) / q),
+        #   which stays accurate for very small q and tends to the q = 0
+        #   solution
+        decay = inflow * elapsed / transmissivity
+        with np.errstate (divide = 'ignore', invalid = 'ignore'):
+            growth = np.where (inflow > 0., -np.expm1 (-decay) / inflow,
+                               elapsed / transmissivity)
+        x = x0 / (np.exp (-decay) + k * x0 * growth)
+        newSoilMoist = satSoilMoist + transmissivity * np.log (x)
+        if instrumentation.active is not None:
+            instrumentation.active.CountClamps (0, newSoilMoist < 1.e-6)
+        newSoilMoist = np.maximum (newSoilMoist, 1.e-6)
+        x = np.exp ((newSoilMoist - satSoilMoist) / transmissivity)
+        if grid.budget is not None:
+            #everything that left the cell went as subsurface flow and
+            #   drainage, in proportion to the sine and cosine of the slope
+            outflow = inflow * elapsed - (newSoilMoist - soilMoist)
+            grid.budget.subsurfInflow [cells] += inflow * elapsed
+            grid.budget.subsurfFlow [cells] += (outflow * sinSlope /
+                                                (sinSlope + cosSlope))
+            grid.budget.drainage [cells] += (outflow * cosSlope /
+                                             (sinSlope + cosSlope))
+        grid.soilMoist [cells] = newSoilMoist
+        grid.infiltRate [cells] = (grid.satInfiltPrime [cells] +
+                                   satSoilMoist / newSoilMoist)
+        grid.overlandFlow [cells] = 0.
+        grid.subsurfFlow [cells] = grid.satInfilt [cells] * sinSlope * x
+        grid.drainage [cells] = grid.satInfilt [cells] * cosSlope * x
+        grid.theta [cells] = newSoilMoist / satSoilMoist
+        self.dormantTime [cells] = toTime
+
+    def _Wake (self, cells):
+        #make dormant cells active, up to date at the start of this step
+        cells = np.unique (cells [self.isDormant [cells]])
+        self._CatchUp (cells, self.time)
+        self.isDormant [cells] = False
+        return cells
+
+    def _Schedule (self, pending, cells):
+        #add cells to those waiting to be updated, grouped by level
+        if cells.size == 0:
+            return
+        levels = self.network.level [cells]
+        byLevel = np.argsort (levels, kind = 'stable')
+        starts = np.flatnonzero (np.diff (levels [byLevel])) + 1
+        for group in np.split (cells [byLevel], starts):
+            pending.setdefault (self.network.level [group [0]], []).append (
+                group)
+
+    def Route (self, rainfallRate, timestep):
+        #advance the landscape by one timestep, updating only active cells
+        grid = self.grid
+        network = self.network
+        endTime = self.time + timestep
+        rainfallRate = np.asarray (rainfallRate, dtype = float)
+        if rainfallRate.ndim == 0:
+            if rainfallRate > 0.:
+                wet = np.flatnonzero (self.isDormant)
+            else:
+                wet = np.zeros (0, dtype = np.int64)
+        else:
+            wet = np.flatnonzero ((rainfallRate > 0.) & self.isDormant)
+        #cells to update, grouped by level and taken in order (a cell is
+        #   only ever scheduled once, as waking it makes it active)
+        pending = {}
+        self._Schedule (pending, self.active)
+        self._Schedule (pending, self._Wake (wet))
+        stillActive = []
+        while pending:
+            cells = pending.pop (min (pending))
+            cells = cells [0] if len (cells) == 1 else np.concatenate (cells)
+            upslope, segments = network.UpslopeLinks (cells)
+            #dormant cells upslope only give subsurface flow
+            dormantUpslope = self.isDormant [upslope]
+            self._CatchUp (upslope [dormantUpslope], endTime)
+            runon = np.bincount (segments, grid.overlandFlow [upslope],
+                                 minlength = cells.size)
+            subsurfInflow = np.bincount (segments, grid.subsurfFlow [upslope],
+                                         minlength = cells.size)
+            if rainfallRate.ndim > 0:
+                rain = rainfallRate [cells]
+            else:
+                rain = rainfallRate
+            grid.UpdateSoilMoist (rain, runon, subsurfInflow, timestep, cells)
+            self.nCellUpdates = self.nCellUpdates + cells.size
+            #cells with nothing happening and only dormant cells upslope go
+            #   dormant
+            quiet = ((rain == 0.) & (runon == 0.) &
+                     (grid.overlandFlow [cells] == 0.) &
+                     (grid.subsurfFlow [cells] + grid.drainage [cells] <
+                      self.threshold) &
+                     (np.bincount (segments, ~dormantUpslope,
+                                   minlength = cells.size) == 0))
+            sleeping = cells [quiet]
+            self.isDormant [sleeping] = True
+            self.dormantTime [sleeping] = endTime
+            self.dormantInflow [sleeping] = subsurfInflow [quiet]
+            awake = cells [~quiet]
+            stillActive.append (awake)
+            #anything downslope of an active cell must be active too
+            starts = network.downslopePtr [awake]
+            lengths = network.downslopePtr [awake + 1] - starts
+            links = (np.repeat (starts - np.cumsum (lengths) + lengths,
+                                lengths) + np.arange (lengths.sum ()))
+            downslope = network.downslopeIndex [links]
+            if self.isDormant [downslope].any ():
+                self._Schedule (pending, self._Wake (downslope))
+        self.active = np.concatenate (stillActive + [np.zeros (0, dtype =
+                                                               np.int64)])
+        self.time = endTime
+        if grid.budget is not None:
+            grid.budget.EndStep (timestep)
+        if instrumentation.active is not None:
+            instrumentation.active.EndStep ()
+
+    def Synchronize (self, cells = None):
+        #bring dormant cells (all, or those given) up to the current time
+        #   before their state is read
+        if cells is None:
+            cells = np.flatnonzero (self.isDormant)
+        else:
+            cells = np.asarray (cells)
+            cells = cells [self.isDormant [cells]]
+        self._CatchUp (cells, self.time)
+
+if __name__ == '__main__':
+    import time as timer
+
+    from benchmark import MakeLandscape
+    from leakyBucketGrid import leakyBucketGrid
+    from routingNetwork import routingNetwork
+
+    #a day of one-minute steps after an hour-long storm, run with every
+    #   cell updated at every step and with dormant cells skipped
+    nCells = 100000
+    parameters, upslopeCells = MakeLandscape (nCells)
+    network = routingNetwork (upslopeCells)
+    timestep = 1. / 60.
+    nSteps = 24 * 60
+    rainfall = 20. * (np.arange (nSteps) < 60)
+    reference = leakyBucketGrid (nCells, *parameters)
+    startTime = timer.perf_counter ()
+    for time in range (0, nSteps):
+        network.Route (reference, rainfall [time], timestep)
+    print ('every cell', timer.perf_counter () - startTime, 's')
+    grid = leakyBucketGrid (nCells, *parameters)
+    scheduler = activeScheduler (grid, network)
+    startTime = timer.perf_counter ()
+    for time in range (0, nSteps):
+        scheduler.Route (rainfall [time], timestep)
+    scheduler.Synchronize ()
+    print ('active cells only', timer.perf_counter () - startTime, 's with',
+           scheduler.nCellUpdates, 'of', nSteps * nCells, 'cell updates')
+    print ('largest soil moisture difference',
+           np.max (np.abs (grid.soilMoist - reference.soilMoist)), 'mm')
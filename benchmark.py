@@ -0,0 +1,261 @@
+"""
+
+@author: John Wainwright
+Benchmarks for the leaky bucket engines and hillslope routing
+Synthetic landscapes of parallel hillslopes (chains of cells, each draining
+into the next) are run for increasing numbers of cells and timesteps with
+each engine and output format, reporting cell updates per second, peak
+memory and the time spent writing output. Before timing anything, every
+engine is checked against the 60-step scenarios of leakyBucket.py,
+simpleHillslope-1.py and simpleHillslope-2.py, so that numerical drift is
+caught along with any loss of speed
+
+usage: python benchmark.py [--cells 3 1000 ...] [--steps 100 1000 ...]
+                           [--engines object grid adaptive numba float32]
+                           [--formats none text npy compressed]
+                           [--max-updates N] [--json report.json]
+
+Variables:
+    engines             'object' (a leakyBucket object per cell, as in
+                        simpleHillslope-2.py), 'grid' (leakyBucketGrid with
+                        a routingNetwork), 'adaptive' (the same with the
+                        adaptive integrator), 'numba' (the grid with the
+                        compiled backend, or NumPy if numba is missing) and
+                        'float32' (the grid with float32 storage)
+    formats             output sinks timed ('none' for no output)
+    hillslopeLength     number of cells in each synthetic hillslope
+    outputCells         number of hillslope outlets written to the output
+    maxUpdates          runs with more cell updates than this are skipped
+    fixtures            final state of the bottom cell in each existing
+                        scenario (soilMoist, overlandFlow, subsurfFlow)
+    tolerance           largest relative difference accepted in a fixture
+                        (only checked for the engines using the explicit
+                        scheme - the adaptive integrator gives different,
+                        mass-conserving, answers and its drift is reported)
+    float32Tolerance    largest relative difference accepted in a fixture
+                        for float32 storage - the error bound given in
+                        leakyBucketGrid.py
+
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time as timer
+import tracemalloc
+
+import numpy as np
+
+from leakyBucket import leakyBucket
+from leakyBucketGrid import leakyBucketGrid
+from outputSink import compressedSink, npySink, textSink
+from routingNetwork import routingNetwork
+
+#(parameters as passed to leakyBucket, number of cells in the catena,
+#   expected final soilMoist, overlandFlow and subsurfFlow of the bottom cell)
+fixtures = {
+    'leakyBucket': ((12., 0.04, 0.38, 10., 500., 5.), 1,
+                    (37.735827194538544, 3.9290030124131157,
+                     2.4836802107772513e-07)),
+    #simpleHillslope-1.py passes five arguments, so its slope is taken as
+    #   the soil depth and the slope is zero
+    'simpleHillslope-1': ((10., 0.04, 0.38, 10., 5.), 3,
+                          (1.6620544109846123, 29.55707547774606, 0.)),
+    'simpleHillslope-2': ((5., 0.04, 0.38, 10., 500., 5.), 3,
+                          (31.456386496012623, 29.78245056283195,
+                           5.5784511455639086e-08)),
+}
+tolerance = 1.e-9
+float32Tolerance = 1.e-6
+exactEngines = ('object', 'grid', 'numba')
+sinks = {'text': (textSink, '.txt'), 'npy': (npySink, '.npy'),
+         'compressed': (compressedSink, '.zip')}
+
+
+def MakeLandscape (nCells, hillslopeLength = 10, seed = 0):
+    #parallel hillslopes with parameters scattered around those of
+    #   simpleHillslope-2.py
+    rng = np.random.default_rng (seed)
+    parameters = (rng.uniform (3., 12., nCells), 0.04,
+                  rng.uniform (0.3, 0.45, nCells),
+                  rng.uniform (5., 15., nCells), rng.uniform (300., 700., nCells),
+                  rng.uniform (2., 15., nCells))
+    upslopeCells = [[] if cell % hillslopeLength == 0 else [cell - 1]
+                    for cell in range (nCells)]
+    return parameters, upslopeCells
+
+
+def Rainfall (nSteps):
+    #hour-long 20 mm/h storms separated by five dry hours (minute steps)
+    return np.where (np.arange (nSteps) % 360 < 60, 20., 0.)
+
+
+class objectEngine:
+    #a leakyBucket object per cell, routed as in simpleHillslope-2.py
+    def __init__ (self, parameters, upslopeCells):
+        nCells = len (upslopeCells)
+        self.catena = []
+        for cell in range (nCells):
+            self.catena.append (leakyBucket (*[float (np.broadcast_to (
+                value, (nCells,)) [cell]) for value in parameters]))
+            self.catena [cell].upslopeCells = list (upslopeCells [cell])
+
+    def Step (self, rainfall, timestep):
+        for thisSoil in self.catena:
+            runon = 0.
+            subsurfInflow = 0.
+            for upslope in thisSoil.upslopeCells:
+                runon = runon + self.catena [upslope].overlandFlow
+                subsurfInflow = subsurfInflow + self.catena [upslope].subsurfFlow
+            thisSoil.UpdateSoilMoist (rainfall, runon, subsurfInflow, timestep)
+
+    def State (self, cells):
+        return np.array ([[self.catena [cell].soilMoist,
+                           self.catena [cell].overlandFlow,
+                           self.catena [cell].subsurfFlow] for cell in cells])
+
+
+class gridEngine:
+    def __init__ (self, parameters, upslopeCells, integrator = 'euler',
+                  backend = 'numpy', storage = 'float64'):
+        self.grid = leakyBucketGrid (len (upslopeCells), *parameters,
+                                     storage = storage)
+        self.grid.integrator = integrator
+        self.grid.backend = backend
+        self.network = routingNetwork (upslopeCells)
+
+    def Step (self, rainfall, timestep):
+        self.network.Route (self.grid, rainfall, timestep)
+
+    def State (self, cells):
+        return np.stack ((self.grid.soilMoist [cells],
+                          self.grid.overlandFlow [cells],
+                          self.grid.subsurfFlow [cells]), axis = 1)
+
+
+def MakeEngine (engine, parameters, upslopeCells):
+    if engine == 'object':
+        return objectEngine (parameters, upslopeCells)
+    if engine == 'grid':
+        return gridEngine (parameters, upslopeCells)
+    if engine == 'adaptive':
+        return gridEngine (parameters, upslopeCells, 'adaptive')
+    if engine == 'numba':
+        return gridEngine (parameters, upslopeCells, backend = 'numba')
+    if engine == 'float32':
+        return gridEngine (parameters, upslopeCells, storage = 'float32')
+    raise ValueError ('unknown engine ' + engine)
+
+
+def CheckFixtures (engines):
+    #run the existing scenarios with every engine, returning the largest
+    #   relative difference from the expected results for each
+    drift = {}
+    for engine in engines:
+        for name, (parameters, nCells, expected) in fixtures.items ():
+            upslopeCells = [[]] + [[cell - 1] for cell in range (1, nCells)]
+            model = MakeEngine (engine, parameters, upslopeCells)
+            for time in range (0, 60):
+                model.Step (20., 1. / 60.)
+            result = model.State ([nCells - 1]) [0]
+            drift [engine + ':' + name] = float (np.max (
+                np.abs (result - expected) / np.maximum (np.abs (expected),
+                                                         1.)))
+    return drift
+
+
+def RunBenchmark (engine, nCells, nSteps, outputFormat = 'none',
+                  hillslopeLength = 10, outputCells = 100):
+    parameters, upslopeCells = MakeLandscape (nCells, hillslopeLength)
+    outlets = np.arange (min (nCells, hillslopeLength) - 1, nCells,
+                         hillslopeLength) [:outputCells]
+    rainfall = Rainfall (nSteps)
+    timestep = 1. / 60.
+    #memory of the landscape and a few steps, traced separately so the
+    #   timing is not slowed down by tracing
+    tracemalloc.start ()
+    model = MakeEngine (engine, parameters, upslopeCells)
+    for time in range (0, min (nSteps, 3)):
+        model.Step (rainfall [time], timestep)
+    peakMemory = tracemalloc.get_traced_memory () [1]
+    tracemalloc.stop ()
+    del model
+    startTime = timer.perf_counter ()
+    model = MakeEngine (engine, parameters, upslopeCells)
+    setupTime = timer.perf_counter () - startTime
+    ioTime = 0.
+    with tempfile.TemporaryDirectory () as outDir:
+        sink = None
+        if outputFormat != 'none':
+            sinkClass, extension = sinks [outputFormat]
+            sink = sinkClass (os.path.join (outDir, 'bench' + extension),
+                              ['time'] + ['overlandFlow' + str (cell)
+                                          for cell in outlets])
+        startTime = timer.perf_counter ()
+        for time in range (0, nSteps):
+            model.Step (rainfall [time], timestep)
+            if sink is not None:
+                ioStart = timer.perf_counter ()
+                sink.Write (time * timestep, *model.State (outlets) [:, 1])
+                ioTime = ioTime + timer.perf_counter () - ioStart
+        if sink is not None:
+            ioStart = timer.perf_counter ()
+            sink.Close ()
+            ioTime = ioTime + timer.perf_counter () - ioStart
+        runTime = timer.perf_counter () - startTime
+    return {'engine': engine, 'nCells': nCells, 'nSteps': nSteps,
+            'format': outputFormat, 'setupSeconds': setupTime,
+            'runSeconds': runTime, 'ioSeconds': ioTime,
+            'cellUpdatesPerSecond': nCells * nSteps / (runTime - ioTime),
+            'peakMemoryBytes': peakMemory}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser (description = 'leaky bucket benchmarks')
+    parser.add_argument ('--cells', type = int, nargs = '+',
+                         default = [3, 1000, 100000, 1000000])
+    parser.add_argument ('--steps', type = int, nargs = '+',
+                         default = [100, 1000, 10000, 100000])
+    parser.add_argument ('--engines', nargs = '+',
+                         default = ['object', 'grid', 'adaptive', 'numba',
+                                    'float32'])
+    parser.add_argument ('--formats', nargs = '+', default = ['none', 'npy'])
+    parser.add_argument ('--hillslope-length', type = int, default = 10)
+    parser.add_argument ('--output-cells', type = int, default = 100)
+    parser.add_argument ('--max-updates', type = float, default = 1.e8)
+    parser.add_argument ('--json', help = 'write the report to this file')
+    args = parser.parse_args ()
+
+    drift = CheckFixtures (args.engines)
+    failed = [name for name, value in drift.items ()
+              if name.split (':') [0] in exactEngines and value > tolerance or
+              name.split (':') [0] == 'float32' and value > float32Tolerance]
+    for name, value in drift.items ():
+        print ('{0:40s} drift {1:.3g} {2}'.format (
+            name, value, 'FAILED' if name in failed else 'ok'))
+    results = []
+    for engine in args.engines:
+        for nCells in args.cells:
+            for nSteps in args.steps:
+                #the object engine is far slower so gets a smaller budget
+                maxUpdates = args.max_updates / (100. if engine == 'object'
+                                                 else 1.)
+                if nCells * nSteps > maxUpdates:
+                    continue
+                for outputFormat in args.formats:
+                    result = RunBenchmark (engine, nCells, nSteps,
+                                           outputFormat,
+                                           args.hillslope_length,
+                                           args.output_cells)
+                    results.append (result)
+                    print ('{engine:9s} {nCells:8d} cells {nSteps:7d} steps '
+                           '{format:10s} {cellUpdatesPerSecond:12.4g} '
+                           'updates/s  io {ioSeconds:8.3f} s  peak memory '
+                           '{peakMemoryBytes:12d} B'.format (**result))
+    if args.json:
+        with open (args.json, 'w') as reportFile:
+            json.dump ({'fixtureDrift': drift, 'tolerance': tolerance,
+                        'float32Tolerance': float32Tolerance,
+                        'results': results}, reportFile, indent = 1)
+    if failed:
+        raise SystemExit ('fixture drift above tolerance')
@@ -0,0 +1,237 @@
+"""
+
+@author: John Wainwright
+Checkpoint and restart of leaky bucket landscapes
+A checkpoint is a directory holding one .npy file for every parameter,
+state and flux array of a leakyBucketGrid (plus its water budget, if any),
+the CSR arrays of the routing network and a small JSON file with the
+simulation clock and the integrator settings. Arrays are stored exactly,
+so a restarted run carries on bit-for-bit as if it had never stopped, and
+they can be memory-mapped back in rather than read. The running summaries
+of any streamStats monitors are saved too (arrays as .npy files, everything
+else in the JSON file), and LoadMonitors puts them back into monitors built
+in the same way on the restored grid, so their summaries cover the whole
+run. Each checkpoint is written to a temporary directory that is then
+renamed into place, so a run killed part-way through writing leaves the
+previous checkpoint intact
+
+Variables:
+    path                directory holding the checkpoint
+    grid                leakyBucketGrid to save or restore
+    network             routingNetwork linking the cells (or None)
+    clock               dictionary describing the simulation clock, e.g.
+                        {'step': steps completed, 'time': time in h}
+    mmap                memory-map arrays on loading (copy-on-write, so the
+                        checkpoint itself is never changed)
+    monitors            streamStats monitors whose reducers are saved, or
+                        restored with LoadMonitors (in the same order, each
+                        with reducers of the same names)
+    every               number of steps between periodic checkpoints
+    keep                number of periodic checkpoints kept on disk
+
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+from waterBudget import fluxNames, waterBudget
+
+gridArrays = ('satInfilt', 'satInfiltPrime', 'satSoilMoist', 'transmissivity',
+              'depth', 'slope', 'soilMoist', 'infiltRate', 'overlandFlow',
+              'subsurfFlow', 'drainage', 'theta', 'subStep')
+gridSettings = ('integrator', 'tolerance', 'minSubStep', 'nSubSteps',
+                'prepared', 'backend', 'storage')
+budgetArrays = fluxNames + ('storageStart',)
+budgetSettings = ('reportEvery', 'tolerance', 'verbose', 'time', 'nSteps',
+                  'reports')
+
+
+def _SaveMonitors (path, monitors):
+    #the state of the reducers of each monitor - arrays are written to
+    #   .npy files and replaced by their file names
+    states = []
+    for i, thisMonitor in enumerate (monitors):
+        reducers = {}
+        for name, reducer in thisMonitor.reducers.items ():
+            reducers [name] = {}
+            for attribute, value in vars (reducer).items ():
+                if isinstance (value, np.ndarray):
+                    fileName = 'monitor{0}_{1}_{2}.npy'.format (i, name,
+                                                                attribute)
+                    np.save (os.path.join (path, fileName), value)
+                    value = {'file': fileName}
+                elif isinstance (value, np.generic):
+                    value = value.item ()
+                reducers [name] [attribute] = value
+        states.append ({'nSteps': thisMonitor.nSteps, 'reducers': reducers})
+    return states
+
+
+def LoadMonitors (path, monitors):
+    #put the saved state of the reducers into monitors (built, e.g. on the
+    #   grid returned by LoadCheckpoint, in the same way as those saved)
+    with open (os.path.join (path, 'checkpoint.json')) as headerFile:
+        states = json.load (headerFile).get ('monitors')
+    if states is None:
+        raise ValueError ('no monitors were saved in ' + path)
+    if len (states) != len (monitors):
+        raise ValueError ('checkpoint holds ' + str (len (states)) +
+                          ' monitors but ' + str (len (monitors)) +
+                          ' were given')
+    for thisMonitor, state in zip (monitors, states):
+        if set (state ['reducers']) != set (thisMonitor.reducers):
+            raise ValueError ('monitor of ' + thisMonitor.variable +
+                              ' has reducers ' +
+                              str (sorted (thisMonitor.reducers)) +
+                              ' but the checkpoint holds ' +
+                              str (sorted (state ['reducers'])))
+        thisMonitor.nSteps = state ['nSteps']
+        for name, reducerState in state ['reducers'].items ():
+            for attribute, value in reducerState.items ():
+                if isinstance (value, dict):
+                    value = np.load (os.path.join (path, value ['file']))
+                setattr (thisMonitor.reducers [name], attribute, value)
+
+
+def SaveCheckpoint (path, grid, network = None, clock = None,
+                    monitors = None):
+    path = os.path.normpath (path)
+    tempPath = path + '.tmp'
+    if os.path.exists (tempPath):
+        shutil.rmtree (tempPath)
+    os.makedirs (tempPath)
+    for name in gridArrays:
+        np.save (os.path.join (tempPath, name + '.npy'), getattr (grid, name))
+    header = {'nCells': grid.nCells, 'clock': clock or {},
+              'grid': {name: getattr (grid, name) for name in gridSettings}}
+    if network is not None:
+        np.save (os.path.join (tempPath, 'upslopePtr.npy'), network.upslopePtr)
+        np.save (os.path.join (tempPath, 'upslopeIndex.npy'),
+                 network.upslopeIndex)
+    if grid.budget is not None:
+        for name in budgetArrays:
+            np.save (os.path.join (tempPath, 'budget_' + name + '.npy'),
+                     getattr (grid.budget, name))
+        header ['budget'] = {name: getattr (grid.budget, name)
+                             for name in budgetSettings}
+    if monitors is not None:
+        header ['monitors'] = _SaveMonitors (tempPath, monitors)
+    with open (os.path.join (tempPath, 'checkpoint.json'), 'w') as headerFile:
+        json.dump (header, headerFile)
+    #swap the new checkpoint into place
+    if os.path.exists (path):
+        oldPath = path + '.old'
+        if os.path.exists (oldPath):
+            shutil.rmtree (oldPath)
+        os.rename (path, oldPath)
+        os.rename (tempPath, path)
+        shutil.rmtree (oldPath)
+    else:
+        os.rename (tempPath, path)
+
+
+def LoadCheckpoint (path, mmap = False):
+    #returns the grid, network (None if none was saved) and clock
+    mode = 'c' if mmap else None
+    with open (os.path.join (path, 'checkpoint.json')) as headerFile:
+        header = json.load (headerFile)
+    grid = leakyBucketGrid (header ['nCells'])
+    for name in gridArrays:
+        setattr (grid, name, np.load (os.path.join (path, name + '.npy'),
+                                      mmap_mode = mode))
+    for name, value in header ['grid'].items ():
+        setattr (grid, name, value)
+    network = None
+    if os.path.exists (os.path.join (path, 'upslopePtr.npy')):
+        network = routingNetwork.FromCSR (
+            np.load (os.path.join (path, 'upslopePtr.npy')),
+            np.load (os.path.join (path, 'upslopeIndex.npy')))
+    if 'budget' in header:
+        budget = waterBudget.__new__ (waterBudget)
+        budget.grid = grid
+        for name in budgetArrays:
+            setattr (budget, name, np.load (os.path.join (
+                path, 'budget_' + name + '.npy'), mmap_mode = mode))
+        for name, value in header ['budget'].items ():
+            setattr (budget, name, value)
+        grid.budget = budget
+    return grid, network, header ['clock']
+
+
+class checkpointer:
+    #writes a checkpoint every few steps, keeping the last few on disk as
+    #   path/step00000100, path/step00000200, ...
+    def __init__ (self, path, every = 1000, keep = 2):
+        self.path = path
+        self.every = every
+        self.keep = keep
+        self.written = []
+        os.makedirs (path, exist_ok = True)
+
+    def Step (self, grid, network, clock, monitors = None):
+        if clock ['step'] % self.every == 0:
+            checkpointPath = os.path.join (
+                self.path, 'step{0:08d}'.format (clock ['step']))
+            SaveCheckpoint (checkpointPath, grid, network, clock, monitors)
+            self.written.append (checkpointPath)
+            while len (self.written) > self.keep:
+                shutil.rmtree (self.written.pop (0))
+
+    def Latest (self):
+        #path of the most recent complete checkpoint (None if none)
+        steps = sorted (name for name in os.listdir (self.path)
+                        if name.startswith ('step') and
+                        not name.endswith (('.tmp', '.old')))
+        if not steps:
+            return None
+        return os.path.join (self.path, steps [-1])
+
+if __name__ == '__main__':
+    from continuousDriver import RunContinuous
+    from streamStats import hydrograph, moments, monitor, peakValue
+    from streamStats import runningTotal
+
+    #run a day of hourly rainfall straight through, then again stopping
+    #   part-way and restarting from the last checkpoint, with the outlet
+    #   summarised on the fly in both
+    nCells = 50
+    timestep = 1.
+    rainfall = np.random.default_rng (2).exponential (5., (24, nCells))
+    upslopeCells = [[]] + [[i] for i in range (nCells - 1)]
+
+    def Monitors (grid, network):
+        return [monitor (grid, 'overlandFlow', network.outlets,
+                         {'total': runningTotal (), 'peak': peakValue (),
+                          'moments': moments (),
+                          'hydrograph': hydrograph (8)})]
+
+    grid = leakyBucketGrid (nCells, 10., 0.04, 0.38, 10., 500., 5.)
+    grid.integrator = 'adaptive'
+    network = routingNetwork (upslopeCells)
+    monitors = Monitors (grid, network)
+    RunContinuous (grid, rainfall, timestep, network, monitors = monitors)
+
+    grid1 = leakyBucketGrid (nCells, 10., 0.04, 0.38, 10., 500., 5.)
+    grid1.integrator = 'adaptive'
+    checkpoints = checkpointer ('checkpoints', every = 5)
+    RunContinuous (grid1, rainfall [:17], timestep,
+                   routingNetwork (upslopeCells), checkpoints = checkpoints,
+                   monitors = Monitors (grid1, network))
+    grid2, network2, clock = LoadCheckpoint (checkpoints.Latest (), mmap = True)
+    monitors2 = Monitors (grid2, network2)
+    LoadMonitors (checkpoints.Latest (), monitors2)
+    RunContinuous (grid2, rainfall, timestep, network2,
+                   startStep = clock ['step'], monitors = monitors2)
+    print ('restarted at step', clock ['step'], 'identical:',
+           np.array_equal (grid.soilMoist, grid2.soilMoist) and
+           np.array_equal (grid.overlandFlow, grid2.overlandFlow))
+    results = monitors [0].Results ()
+    results2 = monitors2 [0].Results ()
+    print ('summaries identical:',
+           all (np.array_equal (results [name] [key], results2 [name] [key])
+                for name in results for key in results [name]))
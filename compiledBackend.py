@@ -0,0 +1,236 @@
+"""
+
+@author: John Wainwright
+Compiled backend for the leaky bucket landscape
+With numba installed, the explicit update of leakyBucketGrid is compiled
+into a loop over cells that works cell by cell in registers - Hortonian
+excess, subsurface flow, saturation overflow and the dry clamp together -
+with no temporary arrays, and the routing of a whole timestep is fused into
+a single loop over the cells in topological order that sums the runon and
+subsurface inflow of each cell from its upslope cells as it goes. The
+arithmetic is the same, step for step, as leakyBucket.UpdateSoilMoist
+(including exp, sin and cos from the C maths library, so results can
+differ from the NumPy grid in the last bit, where NumPy uses its own
+vectorised versions of these functions).
+Choose it by setting grid.backend = 'numba'; if numba cannot be imported
+the grid carries on with the NumPy code. numba is only imported (and the
+loops compiled) the first time the backend is used
+
+Variables:
+    grid                leakyBucketGrid being updated
+    order               cells in topological order (routingNetwork.order)
+    upslopePtr          start of the upslope links of each cell
+    upslopeIndex        upslope cell of each link
+    cells               indices of the cells to update
+    rainfallRate        rainfall rate in mm/h (scalar or one value per cell)
+    runonRate           rate of runon arriving from upslope in mm/h
+    subsurfInflow       subsurface inflow from upslope  in mm/h
+    timestep            length of step in hours
+
+"""
+
+import math
+
+import numpy as np
+
+import instrumentation
+
+_compiled = None
+
+
+def Available ():
+    #whether numba can be used, compiling the loops on the first call
+    global _compiled, _UpdateCell, _UpdateCells, _RouteCells
+    if _compiled is None:
+        try:
+            import numba
+        except ImportError:
+            _compiled = False
+        else:
+            #the loops call _UpdateCell through the module globals, so it
+            #   is compiled first and they pick up the compiled version
+            _UpdateCell = numba.njit (cache = True) (_UpdateCell)
+            _UpdateCells = numba.njit (cache = True) (_UpdateCells)
+            _RouteCells = numba.njit (cache = True) (_RouteCells)
+            _compiled = True
+    return _compiled
+
+
+def _UpdateCell (i, rain, runon, subsurfInflow, timestep, rounding,
+                 satInfilt, satInfiltPrime, satSoilMoist, transmissivity,
+                 slope, soilMoist, infiltRate, overlandFlow, subsurfFlow,
+                 drainage, theta):
+    #one cell of leakyBucketGrid._UpdateEuler (with rounding, the
+    #   correction of leakyBucketGrid._StorageRounding for float32 storage),
+    #   returning 1 if the bucket overflowed, 2 if it ran dry and 0 if not
+    thisSatSoilMoist = satSoilMoist [i]
+    thisSoilMoist = soilMoist [i]
+    thisInfiltRate = satInfiltPrime [i] + thisSatSoilMoist / thisSoilMoist
+    inflowRate = rain + runon
+    thisOverlandFlow = inflowRate - thisInfiltRate
+    if thisOverlandFlow < 0.:
+        thisOverlandFlow = 0.
+    ssfConst = satInfilt [i] * math.exp (-(thisSatSoilMoist - thisSoilMoist) /
+                                         transmissivity [i])
+    thisSubsurfFlow = ssfConst * math.sin (slope [i])
+    thisDrainage = ssfConst * math.cos (slope [i])
+    thisSoilMoist = thisSoilMoist + timestep * (
+        inflowRate + subsurfInflow - thisOverlandFlow - thisSubsurfFlow -
+        thisDrainage)
+    clamp = 0
+    if thisSoilMoist > thisSatSoilMoist:
+        thisOverlandFlow = thisOverlandFlow + (thisSatSoilMoist - thisSoilMoist)
+        thisSoilMoist = thisSatSoilMoist
+        clamp = 1
+    if thisSoilMoist < 0.:
+        thisSoilMoist = 1.e-6
+        thisOverlandFlow = 0.
+        clamp = 2
+    if rounding:
+        storedOverlandFlow = np.float64 (np.float32 (thisOverlandFlow))
+        thisSoilMoist = thisSoilMoist + timestep * (
+            (thisOverlandFlow - storedOverlandFlow) +
+            (thisSubsurfFlow - np.float64 (np.float32 (thisSubsurfFlow))) +
+            (thisDrainage - np.float64 (np.float32 (thisDrainage))))
+        thisOverlandFlow = storedOverlandFlow
+        if thisSoilMoist > thisSatSoilMoist:
+            excess = thisOverlandFlow + (thisSoilMoist -
+                                         thisSatSoilMoist) / timestep
+            rounded = np.float32 (excess)
+            if rounded < excess:
+                rounded = np.nextafter (rounded, np.float32 (np.inf))
+            thisOverlandFlow = np.float64 (rounded)
+            thisSoilMoist = thisSatSoilMoist - timestep * (thisOverlandFlow -
+                                                           excess)
+    soilMoist [i] = thisSoilMoist
+    infiltRate [i] = thisInfiltRate
+    overlandFlow [i] = thisOverlandFlow
+    subsurfFlow [i] = thisSubsurfFlow
+    drainage [i] = thisDrainage
+    theta [i] = thisSoilMoist / thisSatSoilMoist
+    return clamp
+
+
+def _UpdateCells (cells, rain, rainStride, runon, runonStride, subsurfInflow,
+                  inflowStride, timestep, rounding, satInfilt,
+                  satInfiltPrime, satSoilMoist, transmissivity, slope,
+                  soilMoist, infiltRate, overlandFlow, subsurfFlow, drainage,
+                  theta):
+    #inputs with a stride of zero are single values for every cell.
+    #   Returns the numbers of cells that overflowed and ran dry
+    clamps = np.zeros (3, dtype = np.int64)
+    for j in range (cells.size):
+        clamps [_UpdateCell (cells [j], rain [j * rainStride],
+                             runon [j * runonStride],
+                             subsurfInflow [j * inflowStride], timestep,
+                             rounding, satInfilt, satInfiltPrime,
+                             satSoilMoist, transmissivity, slope, soilMoist,
+                             infiltRate, overlandFlow, subsurfFlow, drainage,
+                             theta)] += 1
+    return clamps [1], clamps [2]
+
+
+def _RouteCells (order, upslopePtr, upslopeIndex, rain, rainStride, timestep,
+                 rounding, satInfilt, satInfiltPrime, satSoilMoist,
+                 transmissivity, slope, soilMoist, infiltRate, overlandFlow,
+                 subsurfFlow, drainage, theta):
+    clamps = np.zeros (3, dtype = np.int64)
+    for i in order:
+        runon = 0.
+        subsurfInflow = 0.
+        for link in range (upslopePtr [i], upslopePtr [i + 1]):
+            runon = runon + overlandFlow [upslopeIndex [link]]
+            subsurfInflow = subsurfInflow + subsurfFlow [upslopeIndex [link]]
+        clamps [_UpdateCell (i, rain [i * rainStride], runon, subsurfInflow,
+                             timestep, rounding, satInfilt, satInfiltPrime,
+                             satSoilMoist, transmissivity, slope, soilMoist,
+                             infiltRate, overlandFlow, subsurfFlow, drainage,
+                             theta)] += 1
+    return clamps [1], clamps [2]
+
+
+def _Strided (value, n):
+    #a value as an array with the stride needed to read it for n cells
+    value = np.ascontiguousarray (value, dtype = float)
+    if value.ndim == 0 or value.size == 1 and n != 1:
+        return value.reshape (1), 0
+    return value, 1
+
+
+def _GridArrays (grid):
+    return (grid.satInfilt, grid.satInfiltPrime, grid.satSoilMoist,
+            grid.transmissivity, grid.slope, grid.soilMoist, grid.infiltRate,
+            grid.overlandFlow, grid.subsurfFlow, grid.drainage, grid.theta)
+
+
+def UpdateCells (grid, rainfallRate, runonRate, subsurfInflow, timestep,
+                 cells = slice (None)):
+    #compiled version of leakyBucketGrid._UpdateEuler
+    if isinstance (cells, slice):
+        cells = np.arange (*cells.indices (grid.nCells))
+    else:
+        cells = np.asarray (cells)
+        if cells.dtype == bool:
+            #a mask selects the cells where it is True, as in NumPy
+            cells = np.flatnonzero (cells)
+        cells = cells.astype (np.int64, copy = False).reshape (-1)
+    rain, rainStride = _Strided (rainfallRate, cells.size)
+    runon, runonStride = _Strided (runonRate, cells.size)
+    inflow, inflowStride = _Strided (subsurfInflow, cells.size)
+    clamps = _UpdateCells (cells, rain, rainStride, runon, runonStride,
+                           inflow, inflowStride, float (timestep),
+                           grid.storage == 'float32', *_GridArrays (grid))
+    if instrumentation.active is not None:
+        instrumentation.active.CountClamps (*clamps)
+
+
+def Route (network, grid, rainfallRate, timestep):
+    #compiled version of routingNetwork.Route
+    rain, rainStride = _Strided (rainfallRate, grid.nCells)
+    clamps = _RouteCells (network.order, network.upslopePtr,
+                          network.upslopeIndex, rain, rainStride,
+                          float (timestep), grid.storage == 'float32',
+                          *_GridArrays (grid))
+    if instrumentation.active is not None:
+        instrumentation.active.CountClamps (*clamps)
+
+if __name__ == '__main__':
+    import time as timer
+
+    from benchmark import CheckFixtures, MakeLandscape
+    from leakyBucketGrid import leakyBucketGrid
+    from routingNetwork import routingNetwork
+
+    print ('numba available:', Available ())
+    #the existing scenarios, checked against the leakyBucket results
+    for name, drift in CheckFixtures (['numba']).items ():
+        print (name, 'drift', drift)
+    #updates of a selection of cells (slice, indices and mask) checked
+    #   against the NumPy code
+    selections = {'slice': slice (1, None, 2), 'indices': np.array ([3, 1]),
+                  'mask': np.array ([False, True, False, True])}
+    for name, cells in selections.items ():
+        grids = {}
+        for backend in ('numpy', 'numba'):
+            grids [backend] = leakyBucketGrid (4, 5., 0.04, 0.38, 10., 500.,
+                                               5.)
+            grids [backend].backend = backend
+            for time in range (0, 60):
+                grids [backend].UpdateSoilMoist (20., 1., 0.5, 1. / 60.,
+                                                 cells)
+        print (name, 'difference',
+               np.max (np.abs (grids ['numba'].soilMoist -
+                               grids ['numpy'].soilMoist)))
+    #timing against the NumPy code on a large landscape
+    nCells = 1000000
+    parameters, upslopeCells = MakeLandscape (nCells)
+    network = routingNetwork (upslopeCells)
+    for backend in ('numpy', 'numba'):
+        grid = leakyBucketGrid (nCells, *parameters)
+        grid.backend = backend
+        network.Route (grid, 20., 1. / 60.)
+        startTime = timer.perf_counter ()
+        for time in range (0, 20):
+            network.Route (grid, 20., 1. / 60.)
+        print (backend, (timer.perf_counter () - startTime) / 20.,
+               's per step')
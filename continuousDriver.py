@@ -0,0 +1,164 @@
+"""
+
+@author: John Wainwright
+Continuous simulation with the leaky bucket model driven by long rainfall
+records rather than a single constant-intensity storm
+The rainfall record is read lazily in fixed-size blocks, so memory use stays
+the same however many years of minute or hourly data there are. Each line
+(or element) of the record holds either one rainfall rate applied to every
+cell or one rate per cell for spatially distributed rainfall
+
+Variables:
+    source              rainfall record - name of a text file with one
+                        timestep per line, name of a .npy file (1-D, or 2-D
+                        with one column per cell), or any iterable yielding
+                        a rate (or array of per-cell rates) per timestep
+    blockSize           number of timesteps read and simulated at a time
+    grid                leakyBucketGrid holding the landscape
+    network             routingNetwork linking the cells (None if the cells
+                        are independent)
+    timestep            length of each step in hours
+    sink                outputSink receiving one row per timestep (or None)
+    outputCells         cells written to the sink (default: network outlets,
+                        or every cell when there is no network)
+    startTime           time in hours of the first step
+    startStep           number of steps of the record already simulated
+                        (when restarting from a checkpoint)
+    checkpoints         checkpointer called after every step (or None)
+    monitors            streamStats monitors stepped after every step, given
+                        the same time as the sink (or None). They are saved
+                        with each checkpoint, and when restarting they must
+                        be restored with checkpoint.LoadMonitors, so that
+                        their summaries cover the whole record
+
+"""
+
+from itertools import islice
+
+import numpy as np
+
+
+def RainfallBlocks (source, blockSize):
+    #yield the rainfall record as arrays of at most blockSize rows
+    if isinstance (source, str):
+        if source.endswith ('.npy'):
+            record = np.load (source, mmap_mode = 'r')
+            for start in range (0, record.shape [0], blockSize):
+                yield np.array (record [start:start + blockSize], dtype = float)
+            return
+        with open (source) as rainFile:
+            lines = (line for line in rainFile
+                     if line.strip () and not line.lstrip ().startswith ('#'))
+            while True:
+                block = list (islice (lines, blockSize))
+                if not block:
+                    return
+                block = np.loadtxt (block, ndmin = 2)
+                if block.shape [1] == 1:
+                    block = block [:, 0]
+                yield block
+    else:
+        values = iter (source)
+        while True:
+            block = list (islice (values, blockSize))
+            if not block:
+                return
+            yield np.array (block, dtype = float)
+
+
+def OutputColumns (outputCells):
+    #column names matching the rows written by RunContinuous
+    columns = ['time', 'rainfall']
+    for cell in outputCells:
+        columns = columns + ['soilMoist' + str (cell), 'overlandFlow' +
+                             str (cell), 'subsurfFlow' + str (cell)]
+    return columns
+
+
+def RunContinuous (grid, source, timestep, network = None, blockSize = 1440,
+                   sink = None, outputCells = None, startTime = 0.,
+                   startStep = 0, checkpoints = None, monitors = None):
+    #run the landscape through the rest of the rainfall record, returning
+    #   the number of timesteps of the record completed
+    if outputCells is None:
+        if network is None:
+            outputCells = np.arange (grid.nCells)
+        else:
+            outputCells = network.outlets
+    outputCells = np.asarray (outputCells)
+    if monitors is not None:
+        for thisMonitor in monitors:
+            if thisMonitor.nSteps != startStep:
+                raise ValueError ('monitor of ' + thisMonitor.variable +
+                                  ' has been stepped ' +
+                                  str (thisMonitor.nSteps) +
+                                  ' times but the run starts at step ' +
+                                  str (startStep) + ' - restore monitors ' +
+                                  'with checkpoint.LoadMonitors when ' +
+                                  'restarting')
+    nSteps = 0
+    for block in RainfallBlocks (source, blockSize):
+        #skip the part of the record simulated before a restart
+        if nSteps < startStep:
+            nSkip = min (startStep - nSteps, block.shape [0])
+            block = block [nSkip:]
+            nSteps = nSteps + nSkip
+            if block.shape [0] == 0:
+                continue
+        if block.ndim > 1 and block.shape [1] != grid.nCells:
+            raise ValueError ('rainfall block has ' + str (block.shape [1]) +
+                              ' columns but the landscape has ' +
+                              str (grid.nCells) + ' cells')
+        if sink is not None:
+            output = np.empty ((block.shape [0], 2 + 3 * outputCells.size))
+        for step in range (block.shape [0]):
+            rainfall = block [step]
+            if network is None:
+                grid.UpdateSoilMoist (rainfall, 0., 0., timestep)
+            else:
+                network.Route (grid, rainfall, timestep)
+            if sink is not None:
+                output [step, 0] = startTime + (nSteps + step) * timestep
+                output [step, 1] = np.mean (rainfall)
+                output [step, 2::3] = grid.soilMoist [outputCells]
+                output [step, 3::3] = grid.overlandFlow [outputCells]
+                output [step, 4::3] = grid.subsurfFlow [outputCells]
+            if monitors is not None:
+                for thisMonitor in monitors:
+                    thisMonitor.Step (startTime + (nSteps + step) * timestep,
+                                      timestep, rainfall)
+            if checkpoints is not None:
+                checkpoints.Step (grid, network,
+                                  {'step': nSteps + step + 1,
+                                   'time': startTime + (nSteps + step + 1) *
+                                   timestep}, monitors)
+        if sink is not None:
+            sink.WriteBlock (output)
+        nSteps = nSteps + block.shape [0]
+    return nSteps
+
+if __name__ == '__main__':
+    from leakyBucketGrid import leakyBucketGrid
+    from outputSink import npySink
+    from routingNetwork import routingNetwork
+
+    #a year of synthetic hourly rainfall for a 100-cell hillslope, generated
+    #   on the fly so it is never held in memory as a whole
+    def SyntheticRainfall (nSteps, nCells, seed = 0):
+        rng = np.random.default_rng (seed)
+        for time in range (nSteps):
+            if rng.random () < 0.05:
+                yield rng.exponential (10., nCells)
+            else:
+                yield np.zeros (nCells)
+
+    nCells = 100
+    timestep = 1. #in hours
+    grid = leakyBucketGrid (nCells, 10., 0.04, 0.38, 10., 500., 5.)
+    network = routingNetwork ([[]] + [[i] for i in range (nCells - 1)])
+    with npySink ("continuousResults.npy",
+                  OutputColumns (network.outlets)) as sink:
+        nSteps = RunContinuous (grid, SyntheticRainfall (365 * 24, nCells),
+                                timestep, network, sink = sink)
+    results = np.load ("continuousResults.npy", mmap_mode = 'r')
+    print (nSteps, 'steps, peak outlet overland flow', results [:, 3].max ())
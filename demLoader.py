@@ -0,0 +1,148 @@
+"""
+
+@author: John Wainwright
+Building leaky bucket landscapes from gridded elevation data
+A DEM is read from an ESRI ASCII grid (.asc) or a .npy array, each cell is
+given the steepest downhill of its eight neighbours as its receiver (the D8
+method) and the slope towards it, and the cells are turned into a
+leakyBucketGrid and a routingNetwork. Parameters can be single values or
+rasters of the same shape as the DEM. Everything is done with whole-array
+shifts of the DEM rather than loops over cells
+
+Variables:
+    fileName            name of a .asc or .npy raster
+    cellSize            size of a DEM cell in m (read from the header of
+                        .asc files, needed for .npy files)
+    elevation           elevation raster in m (nan where there is no data)
+    receiver            flat raster index of the cell each cell drains to
+                        (-1 for pits, flats and cells at the edge of the
+                        data with no lower neighbour, which are outlets)
+    slope               slope to the receiver in degrees (0 for outlets)
+    minSlope            smallest slope given to a cell in degrees
+    cellIndex           raster of the index of each cell in the grid (-1
+                        where there is no data)
+
+    parameters (single values, rasters or names of raster files)
+    satInfilt           final infilration rate in mm/h
+    soilMoist           initial soil moisture value in m/m
+    satSoilMoist        saturated soil moisture value in m/m
+    transmissivity      transmissivity value
+    depth               depth of soil in mm
+
+"""
+
+import numpy as np
+
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+
+#row and column offsets of the eight neighbours
+neighbours = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0),
+              (1, 1))
+
+
+def ReadRaster (fileName, cellSize = None):
+    #returns the raster (with nan for missing data) and the cell size
+    if fileName.endswith ('.npy'):
+        return np.array (np.load (fileName), dtype = float), cellSize
+    header = {}
+    with open (fileName) as rasterFile:
+        while True:
+            position = rasterFile.tell ()
+            line = rasterFile.readline ()
+            words = line.split ()
+            if len (words) != 2 or not words [0] [0].isalpha ():
+                rasterFile.seek (position)
+                break
+            header [words [0].lower ()] = float (words [1])
+        values = np.fromstring (rasterFile.read (), sep = ' ')
+    raster = values.reshape (int (header ['nrows']), int (header ['ncols']))
+    if 'nodata_value' in header:
+        raster [raster == header ['nodata_value']] = np.nan
+    return raster, header.get ('cellsize', cellSize)
+
+
+def D8Receivers (elevation, cellSize):
+    #steepest-descent receiver and slope (degrees) for every cell
+    nRows, nCols = elevation.shape
+    padded = np.full ((nRows + 2, nCols + 2), np.nan)
+    padded [1:-1, 1:-1] = elevation
+    flatIndex = np.arange (nRows * nCols).reshape (nRows, nCols)
+    steepest = np.zeros ((nRows, nCols))
+    receiver = np.full ((nRows, nCols), -1, dtype = np.int64)
+    for dRow, dCol in neighbours:
+        neighbour = padded [1 + dRow:nRows + 1 + dRow,
+                            1 + dCol:nCols + 1 + dCol]
+        with np.errstate (invalid = 'ignore'):
+            gradient = (elevation - neighbour) / (cellSize *
+                                                  np.hypot (dRow, dCol))
+            steeper = gradient > steepest
+        steepest [steeper] = gradient [steeper]
+        receiver [steeper] = (flatIndex + dRow * nCols + dCol) [steeper]
+    return receiver, np.degrees (np.arctan (steepest))
+
+
+def _Parameter (value, valid, cellSize):
+    #values of a parameter for the cells with data
+    if isinstance (value, str):
+        value = ReadRaster (value, cellSize) [0]
+    value = np.asarray (value, dtype = float)
+    if value.ndim == 0:
+        return value
+    return value [valid]
+
+
+def LoadLandscape (fileName, cellSize = None, satInfilt = 10.,
+                   soilMoist = 0.04, satSoilMoist = 0.38,
+                   transmissivity = 10., depth = 500., minSlope = 0.):
+    #returns the leakyBucketGrid, the routingNetwork and the cellIndex raster
+    elevation, cellSize = ReadRaster (fileName, cellSize)
+    if cellSize is None:
+        raise ValueError ('cellSize is needed for ' + fileName)
+    receiver, slope = D8Receivers (elevation, cellSize)
+    valid = ~np.isnan (elevation)
+    cellIndex = np.full (elevation.shape, -1, dtype = np.int64)
+    nCells = int (np.count_nonzero (valid))
+    cellIndex [valid] = np.arange (nCells)
+    #receivers as grid cell indices, then upslope links in CSR form
+    receiver = receiver [valid]
+    hasReceiver = receiver >= 0
+    receiver [hasReceiver] = cellIndex.ravel () [receiver [hasReceiver]]
+    donors = np.flatnonzero (hasReceiver)
+    linkOrder = np.argsort (receiver [donors], kind = 'stable')
+    upslopePtr = np.zeros (nCells + 1, dtype = np.int64)
+    np.cumsum (np.bincount (receiver [donors], minlength = nCells),
+               out = upslopePtr [1:])
+    network = routingNetwork.FromCSR (upslopePtr, donors [linkOrder])
+    grid = leakyBucketGrid (nCells,
+                            _Parameter (satInfilt, valid, cellSize),
+                            _Parameter (soilMoist, valid, cellSize),
+                            _Parameter (satSoilMoist, valid, cellSize),
+                            _Parameter (transmissivity, valid, cellSize),
+                            _Parameter (depth, valid, cellSize),
+                            np.maximum (slope [valid], minSlope))
+    return grid, network, cellIndex
+
+if __name__ == '__main__':
+    import time as timer
+
+    #a synthetic valley - two planar hillslopes draining to a sloping
+    #   channel - written as an ASCII grid and loaded back
+    nRows, nCols = 500, 400
+    rows, cols = np.mgrid [0:nRows, 0:nCols]
+    elevation = 100. + 0.05 * rows + 0.1 * np.abs (cols - nCols / 2)
+    elevation [:5, :5] = -9999.
+    with open ("valley.asc", 'w') as demFile:
+        demFile.write ("ncols " + str (nCols) + "\nnrows " + str (nRows) +
+                       "\nxllcorner 0\nyllcorner 0\ncellsize 10\n" +
+                       "NODATA_value -9999\n")
+        np.savetxt (demFile, elevation, fmt = '%.3f')
+    startTime = timer.perf_counter ()
+    grid, network, cellIndex = LoadLandscape ("valley.asc",
+                                              depth = 300. + 0.5 * cols)
+    print ('loaded', grid.nCells, 'cells in',
+           timer.perf_counter () - startTime, 's -',
+           network.outlets.size, 'outlets,', network.nLevels, 'levels')
+    for time in range (0, 60):
+        network.Route (grid, 20., 1. / 60.)
+    print ('largest overland flow', grid.overlandFlow.max (), 'mm/h')
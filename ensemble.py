@@ -0,0 +1,165 @@
+"""
+
+@author: John Wainwright
+Parameter sweeps and Monte Carlo ensembles of the simple hillslope
+Each ensemble member is the catena of simpleHillslope-2.py (a chain of leaky
+bucket cells, each draining into the one below) with its own parameter
+values. Members are run together as one leakyBucketGrid in which each member
+is a separate chain, and large ensembles are split into batches that are
+run in parallel in a pool of worker processes
+
+Variables:
+    parameter names (any not given take the values in simpleHillslope-2.py)
+    initialSatInfilt        final infilration rate in mm/h
+    initialSoilMoist        initial soil moisture value in m/m
+    initialSatSoilMoist     initial saturated soil moisture value in m/m
+    initialTransmissivity   initial transmissivity value
+    initialDepth            initial depth of soil in mm
+    initialSlope            initial slope angle in degrees
+
+    variables used to run the ensemble
+    members             dictionary of parameter name: array with one value
+                        per member
+    rainfall            rainfall rate in mm/h - constant, or one value per
+                        timestep
+    stormLength         number of timesteps
+    timestep            length of each step in hours
+    nCells              number of cells in each catena
+    processes           number of worker processes (None for all cores, 1
+                        to run in this process)
+    batchSize           number of members run together in one grid
+
+    summary outputs (one row per member in the result table, along with
+    the parameters)
+    peakOverlandFlow    peak rate of overland flow from the bottom cell in mm/h
+    timeToPeak          time of the peak in h
+    runoffVolume        total overland flow from the bottom cell in mm
+    finalSoilMoist      soil moisture of the bottom cell at the end in mm
+
+"""
+
+import os
+from itertools import product
+from multiprocessing import Pool
+
+import numpy as np
+
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+from streamStats import monitor, peakValue, runningTotal
+
+parameterNames = ('initialSatInfilt', 'initialSoilMoist',
+                  'initialSatSoilMoist', 'initialTransmissivity',
+                  'initialDepth', 'initialSlope')
+defaultParameters = {'initialSatInfilt': 5., 'initialSoilMoist': 0.04,
+                     'initialSatSoilMoist': 0.38,
+                     'initialTransmissivity': 10., 'initialDepth': 500.,
+                     'initialSlope': 5.}
+summaryNames = ('peakOverlandFlow', 'timeToPeak', 'runoffVolume',
+                'finalSoilMoist')
+
+
+def ParameterGrid (**values):
+    #every combination of the values given for each parameter
+    names = list (values.keys ())
+    combinations = np.array (list (product (*[np.atleast_1d (values [name])
+                                              for name in names])),
+                             dtype = float)
+    return {name: combinations [:, i] for i, name in enumerate (names)}
+
+
+def ParameterSamples (distributions, nMembers, seed = None):
+    #Monte Carlo samples - each distribution is either a (low, high) pair
+    #   for a uniform distribution or a function of (rng, nMembers)
+    rng = np.random.default_rng (seed)
+    members = {}
+    for name, distribution in distributions.items ():
+        if callable (distribution):
+            members [name] = np.asarray (distribution (rng, nMembers),
+                                         dtype = float)
+        else:
+            low, high = distribution
+            members [name] = rng.uniform (low, high, nMembers)
+    return members
+
+
+def CatenaNetwork (nMembers, nCells):
+    #separate chains of nCells cells, each cell draining into the next one
+    upslopeCells = []
+    for member in range (nMembers):
+        upslopeCells.append ([])
+        for cell in range (1, nCells):
+            upslopeCells.append ([member * nCells + cell - 1])
+    return routingNetwork (upslopeCells)
+
+
+def RunBatch (members, rainfall = 20., stormLength = 60, timestep = 1. / 60.,
+              nCells = 3):
+    #run a batch of members together, returning a dictionary of summary
+    #   arrays with one value per member
+    unknown = set (members) - set (parameterNames)
+    if unknown:
+        raise ValueError ('unknown parameters ' + str (sorted (unknown)))
+    nMembers = len (next (iter (members.values ())))
+    parameters = [np.repeat (np.broadcast_to (members.get (
+        name, defaultParameters [name]), (nMembers,)), nCells)
+                  for name in parameterNames]
+    grid = leakyBucketGrid (nMembers * nCells, *parameters)
+    network = CatenaNetwork (nMembers, nCells)
+    outlets = np.arange (nCells - 1, nMembers * nCells, nCells)
+    rainfall = np.broadcast_to (np.asarray (rainfall, dtype = float),
+                                (stormLength,))
+    overlandFlow = monitor (grid, 'overlandFlow', outlets,
+                            {'peak': peakValue (np.zeros (nMembers)),
+                             'total': runningTotal ()})
+    for time in range (0, stormLength):
+        network.Route (grid, rainfall [time], timestep)
+        overlandFlow.Step (time * timestep, timestep)
+    results = overlandFlow.Results ()
+    return {'peakOverlandFlow': results ['peak'] ['peak'],
+            'timeToPeak': results ['peak'] ['timeToPeak'],
+            'runoffVolume': results ['total'] ['total'],
+            'finalSoilMoist': grid.soilMoist [outlets].copy ()}
+
+
+def _RunBatchArgs (args):
+    return RunBatch (*args)
+
+
+def RunEnsemble (members, rainfall = 20., stormLength = 60,
+                 timestep = 1. / 60., nCells = 3, processes = None,
+                 batchSize = 1000):
+    #run every member and return a structured array holding the parameters
+    #   and summary outputs of each member
+    nMembers = len (next (iter (members.values ())))
+    batches = [({name: np.asarray (values [start:start + batchSize])
+                 for name, values in members.items ()},
+                rainfall, stormLength, timestep, nCells)
+               for start in range (0, nMembers, batchSize)]
+    if processes is None:
+        processes = os.cpu_count ()
+    if processes == 1 or len (batches) == 1:
+        summaries = [_RunBatchArgs (batch) for batch in batches]
+    else:
+        with Pool (min (processes, len (batches))) as pool:
+            summaries = pool.map (_RunBatchArgs, batches)
+    results = np.zeros (nMembers, dtype = [(name, float) for name in
+                                           list (members) +
+                                           list (summaryNames)])
+    for name in members:
+        results [name] = members [name]
+    for name in summaryNames:
+        results [name] = np.concatenate ([summary [name]
+                                         for summary in summaries])
+    return results
+
+if __name__ == '__main__':
+    #sweep the four calibration parameters over a grid
+    members = ParameterGrid (initialSatInfilt = np.linspace (2., 20., 10),
+                             initialTransmissivity = np.linspace (5., 20., 5),
+                             initialDepth = np.linspace (200., 800., 7),
+                             initialSlope = np.linspace (1., 20., 10))
+    results = RunEnsemble (members, batchSize = 500)
+    print (len (results), 'members')
+    for name in summaryNames:
+        print (name, results [name].min (), results [name].max ())
@@ -0,0 +1,189 @@
+"""
+
+@author: John Wainwright
+Instrumentation of model runs
+While a set of instruments is switched on (with Enable, or a with block),
+the model keeps time spent in each phase of a run and counts what happened:
+    phases              update (working out the fluxes and the new soil
+                        moisture of cells), accumulation (summing runon and
+                        subsurface inflow from upslope cells), output
+                        (writing to output sinks) and plotting
+    counters            steps, cellUpdates, saturationOverflow (cell
+                        updates where the bucket filled and the excess was
+                        added to overland flow) and negativeMoisture
+                        (updates where the soil moisture went below zero,
+                        or below 1.e-6 in the adaptive integrator and when
+                        dormant cells catch up, and was reset) - counted
+                        by the integrators where the clamps are applied
+Memory can be sampled every few steps - the peak resident size of the
+process and, if tracemalloc is running, the memory it has traced. Report
+returns everything as a dictionary, which Save writes as JSON (and which is
+written automatically on leaving a with block if a reportFile is given).
+When nothing is switched on, the only cost is checking that active is None
+at each hook
+
+Variables:
+    active              instruments currently switched on (None if none)
+    memoryEvery         number of steps between memory samples (0 for none)
+    reportFile          JSON file the report is written to when the
+                        instruments are switched off (None for none)
+    phase               name of a phase of the run
+    name                name of a counter
+
+"""
+
+import json
+import time as timer
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+phaseNames = ('update', 'accumulation', 'output', 'plotting')
+counterNames = ('steps', 'cellUpdates', 'saturationOverflow',
+                'negativeMoisture')
+active = None
+
+
+class instruments:
+    def __init__ (self, memoryEvery = 0, reportFile = None):
+        self.memoryEvery = memoryEvery
+        self.reportFile = reportFile
+        self.Reset ()
+
+    def Reset (self):
+        self.seconds = dict.fromkeys (phaseNames, 0.)
+        self.calls = dict.fromkeys (phaseNames, 0)
+        self.counters = dict.fromkeys (counterNames, 0)
+        self.memory = []
+        self.startTime = timer.perf_counter ()
+
+    def __enter__ (self):
+        return Enable (self)
+
+    def __exit__ (self, excType, excValue, traceback):
+        Disable ()
+
+    def Start (self):
+        return timer.perf_counter ()
+
+    def Stop (self, phase, start):
+        #add the time since start to a phase
+        self.seconds [phase] = (self.seconds.get (phase, 0.) +
+                                timer.perf_counter () - start)
+        self.calls [phase] = self.calls.get (phase, 0) + 1
+
+    def Count (self, name, n = 1):
+        self.counters [name] = self.counters.get (name, 0) + int (n)
+
+    def CountUpdates (self, grid, cells = slice (None)):
+        #count the cells just updated
+        if isinstance (cells, slice):
+            self.Count ('cellUpdates', len (range (*cells.indices (
+                grid.nCells))))
+        elif np.asarray (cells).dtype == bool:
+            self.Count ('cellUpdates', np.count_nonzero (cells))
+        else:
+            self.Count ('cellUpdates', np.size (cells))
+
+    def CountClamps (self, saturated, dry):
+        #count the cells (masks, or numbers of cells) where the bucket
+        #   overflowed and where it ran dry
+        self.Count ('saturationOverflow', np.count_nonzero (saturated)
+                    if np.ndim (saturated) else saturated)
+        self.Count ('negativeMoisture', np.count_nonzero (dry)
+                    if np.ndim (dry) else dry)
+
+    def EndStep (self):
+        #called once every cell has been advanced through a timestep
+        self.Count ('steps')
+        if (self.memoryEvery and
+                self.counters ['steps'] % self.memoryEvery == 0):
+            self.SampleMemory ()
+
+    def SampleMemory (self):
+        sample = {'step': self.counters ['steps'],
+                  'seconds': timer.perf_counter () - self.startTime}
+        if resource is not None:
+            #ru_maxrss is in kilobytes on Linux
+            sample ['peakResidentBytes'] = 1024 * resource.getrusage (
+                resource.RUSAGE_SELF).ru_maxrss
+        if tracemalloc.is_tracing ():
+            sample ['tracedBytes'], sample ['tracedPeakBytes'] = (
+                tracemalloc.get_traced_memory ())
+        self.memory.append (sample)
+
+    def Report (self):
+        wallSeconds = timer.perf_counter () - self.startTime
+        report = {'wallSeconds': wallSeconds,
+                  'phases': {phase: {'seconds': self.seconds [phase],
+                                     'calls': self.calls [phase]}
+                             for phase in self.seconds},
+                  'otherSeconds': wallSeconds - sum (self.seconds.values ()),
+                  'counters': dict (self.counters),
+                  'memory': list (self.memory)}
+        update = self.seconds.get ('update', 0.)
+        if update > 0.:
+            report ['cellUpdatesPerSecond'] = (self.counters ['cellUpdates'] /
+                                               update)
+        return report
+
+    def Save (self, fileName):
+        with open (fileName, 'w') as reportFile:
+            json.dump (self.Report (), reportFile, indent = 1)
+
+
+def Enable (theseInstruments = None, memoryEvery = 0, reportFile = None):
+    #switch instruments on (new ones unless given), returning them
+    global active
+    if theseInstruments is None:
+        theseInstruments = instruments (memoryEvery, reportFile)
+    active = theseInstruments
+    return active
+
+
+def Disable ():
+    #switch the instruments off, writing their report if they have a file
+    global active
+    theseInstruments = active
+    active = None
+    if theseInstruments is not None and theseInstruments.reportFile:
+        theseInstruments.Save (theseInstruments.reportFile)
+    return theseInstruments
+
+if __name__ == '__main__':
+    #the hooks in the model read active from the imported module, not from
+    #   this script
+    import instrumentation
+    from benchmark import MakeLandscape
+    from leakyBucketGrid import leakyBucketGrid
+    from outputSink import npySink
+    from routingNetwork import routingNetwork
+
+    #an hour of storm on 100000 cells with the outlets written to a file,
+    #   once without instruments and once with them
+    nCells = 100000
+    parameters, upslopeCells = MakeLandscape (nCells)
+    network = routingNetwork (upslopeCells)
+
+    def Run ():
+        grid = leakyBucketGrid (nCells, *parameters)
+        startTime = timer.perf_counter ()
+        with npySink ("instrumentedResults.npy",
+                      ['overlandFlow' + str (cell)
+                       for cell in network.outlets]) as sink:
+            for time in range (0, 60):
+                network.Route (grid, 20., 1. / 60.)
+                sink.Write (*grid.overlandFlow [network.outlets])
+        return timer.perf_counter () - startTime
+
+    print ('without instruments', Run (), 's')
+    with instrumentation.instruments (
+            memoryEvery = 10,
+            reportFile = "instrumentReport.json") as theseInstruments:
+        print ('with instruments', Run (), 's')
+    print (json.dumps (theseInstruments.Report (), indent = 1))
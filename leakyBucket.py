@@ -53,14 +53,21 @@ Variables:
     overlandFlowOut     used to plot and output overland flow rate
     subsurfFlowOut      used to plot and output subsurface flow rate
     time                index in main loop to run through each time step
+    outFile             buffered output sink (see outputSink.py)
 
 """
 
-import matplotlib.pyplot as plt
 from math import pi, sin, cos, exp
 
 
 class leakyBucket:
+    #fixed attributes rather than a __dict__ to keep each cell small (see
+    #   leakyBucketGrid.py for a much more compact landscape)
+    __slots__ = ('satInfilt', 'satInfiltPrime', 'satSoilMoist',
+                 'transmissivity', 'slope', 'soilMoist', 'infiltRate',
+                 'overlandFlow', 'subsurfFlow', 'drainage', 'depth', 'theta',
+                 'upslopeCells')
+
     def __init__ (self, initialSatInfilt = 0., initialSoilMoist = 0., 
                   initialSatSoilMoist = 0., initialTransmissivity = 0., 
                   initialDepth = 0., initialSlope = 0.):
@@ -130,7 +137,88 @@ class leakyBucket:
         #update relative soil moisture [mm/mm]
         self.theta = self.soilMoist / self.satSoilMoist
 
+
+class preparedLeakyBucket (leakyBucket):
+    #same model, but with the constants of UpdateSoilMoist worked out
+    #   whenever the parameters are set rather than at every step - slope
+    #   and transmissivity must be changed through SetParameters. With no
+    #   transmissivity or saturated soil moisture yet (as when created with
+    #   the default arguments and given its parameters later), the
+    #   constants are left until the first update
+    __slots__ = ('satInfiltSin', 'satInfiltCos', 'recipTransmissivity',
+                 'recipSatSoilMoist')
+
+    def __init__ (self, initialSatInfilt = 0., initialSoilMoist = 0., 
+                  initialSatSoilMoist = 0., initialTransmissivity = 0., 
+                  initialDepth = 0., initialSlope = 0.):
+        leakyBucket.__init__ (self, initialSatInfilt, initialSoilMoist, 
+                              initialSatSoilMoist, initialTransmissivity, 
+                              initialDepth, initialSlope)
+        self._PrepareIfSet ()
+
+    def SetParameters (self, initialSatInfilt, initialSoilMoist, 
+                       initialSatSoilMoist, initialTransmissivity, 
+                       initialDepth, initialSlope):
+        leakyBucket.SetParameters (self, initialSatInfilt, initialSoilMoist, 
+                                   initialSatSoilMoist, initialTransmissivity, 
+                                   initialDepth, initialSlope)
+        self._PrepareIfSet ()
+
+    def _PrepareIfSet (self):
+        if self.transmissivity == 0. or self.satSoilMoist == 0.:
+            self.recipTransmissivity = None
+        else:
+            self.Prepare ()
+
+    def Prepare (self):
+        self.satInfiltSin = self.satInfilt * sin (self.slope)
+        self.satInfiltCos = self.satInfilt * cos (self.slope)
+        self.recipTransmissivity = 1. / self.transmissivity
+        self.recipSatSoilMoist = 1. / self.satSoilMoist
+        if self.satInfiltSin < 0:
+            print ('negative subsurface flow', self.satInfilt, self.slope)
+
+    def UpdateSoilMoist (self, rainfallRate, runonRate, subsurfInflow, timestep):
+        if self.recipTransmissivity is None:
+            self.Prepare ()
+        soilMoist = self.soilMoist
+        satSoilMoist = self.satSoilMoist
+        #calculate current value of infiltration rate
+        infiltRate = self.satInfiltPrime + satSoilMoist / soilMoist
+        #calculate Hortonian overland flow
+        inflowRate = rainfallRate + runonRate
+        if (inflowRate > infiltRate):
+            overlandFlow = inflowRate - infiltRate
+        else:
+            overlandFlow = 0.
+        #calculate subsurface flow and drainage
+        exponential = exp ((soilMoist - satSoilMoist) * self.recipTransmissivity)
+        subsurfFlow = self.satInfiltSin * exponential
+        drainage = self.satInfiltCos * exponential
+        #update soil moisture
+        soilMoist = soilMoist + timestep * (inflowRate + subsurfInflow - 
+                                            overlandFlow - subsurfFlow - 
+                                            drainage)
+        #check if saturation overland flow has occurred and if so add it to HOF 
+        #  and stop bucket overflow
+        if (soilMoist > satSoilMoist):
+            overlandFlow = overlandFlow + (satSoilMoist - soilMoist)
+            soilMoist = satSoilMoist
+        elif (soilMoist < 0.):
+            soilMoist = 1.e-6
+            overlandFlow = 0.
+        self.soilMoist = soilMoist
+        self.infiltRate = infiltRate
+        self.overlandFlow = overlandFlow
+        self.subsurfFlow = subsurfFlow
+        self.drainage = drainage
+        #update relative soil moisture [mm/mm]
+        self.theta = soilMoist * self.recipSatSoilMoist
+
 if __name__ == '__main__':
+    from modelPlots import GetPyplot, ShowFigure
+    from outputSink import textSink
+
     #simple test with constant rainfall rate
     rainfall = 20. #20 mm/h 
     finalInfiltRate = 12. #12 mm/h so should produce HOF
@@ -150,29 +238,25 @@ if __name__ == '__main__':
     soilMoistOut = []
     overlandFlowOut = []
     subsurfFlowOut = []
-    with open ("LeakyBucketResultsFile.txt", 'w') as outFile:   
-        #output header
-        outFile.write ("time rainfall infiltrationRate subsurfFlow " + 
-                       "drainage soilMoist overlandFlow\n")
-
+    #output is buffered and written in bulk - set echoEvery to 0 to stop
+    #   printing each step to the console
+    with textSink ("LeakyBucketResultsFile.txt", 
+                   ["time", "rainfall", "infiltrationRate", "subsurfFlow", 
+                    "drainage", "soilMoist", "overlandFlow"], 
+                   echoEvery = 1, intColumns = ["time"]) as outFile:
         for time in range (0, stormLength):
             #update this timestep - nothing upslope so zero runon and subsurf inflow
             soil.UpdateSoilMoist (rainfall, 0., 0., timestep)
-            print (time, rainfall, soil.infiltRate, soil.subsurfFlow, 
-                   soil.drainage, soil.soilMoist, soil.overlandFlow)
-            outFile.write (str (time) + " " + str (rainfall) + " " + 
-                           str (soil.infiltRate) + " " + 
-                           str (soil.subsurfFlow) + " " + 
-                           str (soil.drainage) + " " + 
-                           str (soil.soilMoist) + " " + 
-                           str (soil.overlandFlow) + "\n")
+            outFile.Write (time, rainfall, soil.infiltRate, soil.subsurfFlow, 
+                           soil.drainage, soil.soilMoist, soil.overlandFlow)
             timeOut.append (time * timestep) #convert to h
             rainOut.append (rainfall)
             soilMoistOut.append (soil.soilMoist)
             overlandFlowOut.append (soil.overlandFlow)
             subsurfFlowOut.append (soil.subsurfFlow)
     
-    # plot results
+    # plot results (matplotlib is only loaded here)
+    plt = GetPyplot ()
     fig, ax = plt.subplots ()
     # create a line using rainfall data
     line1, = ax.plot (timeOut, rainOut, label = 'rainfall')
@@ -186,6 +270,6 @@ if __name__ == '__main__':
     plt.xlabel ('time  [h]')
     plt.ylabel ('rate [mm/h]')
     ax.legend ()
-    plt.show ()        
+    ShowFigure (fig, "leakyBucketResults.png")        
         
                         
\ No newline at end of file
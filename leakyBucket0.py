@@ -35,12 +35,15 @@ Variables:
     overlandFlowOut     used to plot and output overland flow rate
     subsurfFlowOut      used to plot and output subsurface flow rate
     time                index in main loop to run through each time step
+    outFile             buffered output sink (see outputSink.py)
 
 """
 
-import matplotlib.pyplot as plt
 from math import pi, sin, cos, exp
 
+from modelPlots import GetPyplot, ShowFigure
+from outputSink import textSink
+
 #simple test with constant rainfall rate
 rainfall = 20. # mm/h 
 finalInfiltRate = 12. # mm/h
@@ -78,11 +81,12 @@ soilMoistOut = []
 overlandFlowOut = []
 subsurfFlowOut = []
 
-with open ("LeakyBucket0ResultsFile.txt", 'w') as outFile:   
-    #output header
-    outFile.write ("time rainfall infiltrationRate subsurfFlow " + 
-                   "drainage soilMoist overlandFlow\n")
-
+#output is buffered and written in bulk - set echoEvery to 0 to stop printing
+#   each step to the console
+with textSink ("LeakyBucket0ResultsFile.txt", 
+               ["time", "rainfall", "infiltrationRate", "subsurfFlow", 
+                "drainage", "soilMoist", "overlandFlow"], 
+               echoEvery = 1, intColumns = ["time"]) as outFile:   
     for time in range (0, stormLength):
         #calculate current value of infiltration rate
         infiltrationRate = finalInfiltPrime + (satSoilMoist / soilMoist)
@@ -113,21 +117,18 @@ with open ("LeakyBucket0ResultsFile.txt", 'w') as outFile:
         #update relative soil moisture [mm/mm]
         theta = soilMoist / satSoilMoist
 
-        print (time, rainfall, infiltrationRate, subsurfFlow, 
-               drainage, soilMoist, overlandFlow)
-        outFile.write (str (time) + " " + str (rainfall) + " " + 
-                       str (infiltrationRate) + " " + str (subsurfFlow) + 
-                       " " + str (drainage) + " " + str (soilMoist) + " " + 
-                       str (overlandFlow) + "\n")
+        outFile.Write (time, rainfall, infiltrationRate, subsurfFlow, 
+                       drainage, soilMoist, overlandFlow)
         timeOut.append (time * timestep) #convert to h
         rainOut.append (rainfall)
         soilMoistOut.append (soilMoist)
         overlandFlowOut.append (overlandFlow)
         subsurfFlowOut.append (subsurfFlow)
     #main time loop ends here because of indentation
-#output file closes here because of indentation
+#output is flushed and the file closes here because of indentation
     
-# end of storm -- plot results
+# end of storm -- plot results (run with --headless to skip showing them)
+plt = GetPyplot ()
 fig, ax = plt.subplots ()
 # create a line using rainfall data
 line1, = ax.plot (timeOut, rainOut, label = 'rainfall')
@@ -141,7 +142,7 @@ line4, = ax.plot (timeOut, subsurfFlowOut, label = 'subsurface flow')
 plt.xlabel ('time  [h]')
 plt.ylabel ('rate [mm/h]')
 ax.legend ()
-plt.show ()        
+ShowFigure (fig)        
 
 fig.savefig ("leakyBucketResults.jpg")  #save the figure for future use
         
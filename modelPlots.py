@@ -0,0 +1,55 @@
+"""
+
+@author: John Wainwright
+Plotting support for the model scripts
+matplotlib is only imported when a script actually plots, so importing the
+model itself (from leakyBucket import leakyBucket) stays quick in worker
+processes. In headless mode - running a script with --headless or with the
+environment variable MODEL_HEADLESS=1 - figures are written to files using
+the non-interactive Agg backend instead of being shown on screen, so the
+scripts can be run on machines without a display
+
+Variables:
+    fig                 figure to show or save
+    fileName            file the figure is saved to in headless mode
+    block               wait for the plot window to be closed (as
+                        plt.show) rather than drawing and carrying on (as
+                        plt.draw followed by plt.pause)
+
+"""
+
+import os
+import sys
+
+import instrumentation
+
+
+def Headless ():
+    return ('--headless' in sys.argv or
+            os.environ.get ('MODEL_HEADLESS', '') not in ('', '0'))
+
+
+def GetPyplot ():
+    #import pyplot, choosing a non-interactive backend in headless mode
+    import matplotlib
+    if Headless ():
+        matplotlib.use ('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def ShowFigure (fig, fileName = None, block = True):
+    timing = instrumentation.active
+    if timing is not None:
+        start = timing.Start ()
+    plt = GetPyplot ()
+    if Headless ():
+        if fileName is not None:
+            fig.savefig (fileName)
+    elif block:
+        plt.show ()
+    else:
+        plt.draw ()
+        plt.pause (0.001)
+    if timing is not None:
+        timing.Stop ('plotting', start)
@@ -0,0 +1,201 @@
+"""
+
+@author: John Wainwright
+Buffered output of model time series
+Rows of output are copied into a preallocated chunk buffer and only written
+to disk when the buffer is full (or the sink is closed), so long runs are
+not dominated by writing and formatting a line of text every timestep.
+Echoing rows to the console is optional and can be throttled to every nth
+row. Three formats are available:
+    textSink            space-delimited text, as written by leakyBucket.py
+    npySink             binary .npy file that can be read back with
+                        numpy.load (fileName, mmap_mode = 'r')
+    compressedSink      zip file of compressed column chunks, read back
+                        with ReadCompressed
+
+Variables:
+    fileName            name of output file
+    columns             names of the output columns
+    chunkSize           number of rows held in memory before writing
+    echoEvery           print every nth row to the console (0 for none)
+    intColumns          names of columns written as integers (textSink)
+    nRows               number of rows written so far (including buffered)
+
+"""
+
+import struct
+import zipfile
+from io import BytesIO
+
+import numpy as np
+
+import instrumentation
+
+
+class outputSink:
+    def __init__ (self, fileName, columns, chunkSize = 4096, echoEvery = 0):
+        self.fileName = fileName
+        self.columns = list (columns)
+        self.chunkSize = chunkSize
+        self.echoEvery = echoEvery
+        self.buffer = np.empty ((chunkSize, len (self.columns)))
+        self.nBuffered = 0
+        self.nRows = 0
+        self.closed = False
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, excType, excValue, traceback):
+        self.Close ()
+
+    def Write (self, *values):
+        #add one row of output
+        timing = instrumentation.active
+        if timing is not None:
+            start = timing.Start ()
+        if self.echoEvery and self.nRows % self.echoEvery == 0:
+            print (*values)
+        self.buffer [self.nBuffered] = values
+        self.nBuffered = self.nBuffered + 1
+        self.nRows = self.nRows + 1
+        if self.nBuffered == self.chunkSize:
+            self.Flush ()
+        if timing is not None:
+            timing.Stop ('output', start)
+
+    def WriteBlock (self, block):
+        #add many rows of output at once (one row per timestep)
+        timing = instrumentation.active
+        if timing is not None:
+            startTime = timing.Start ()
+        block = np.asarray (block, dtype = float)
+        if self.echoEvery:
+            for row in range (-self.nRows % self.echoEvery, block.shape [0],
+                              self.echoEvery):
+                print (*block [row].tolist ())
+        start = 0
+        while start < block.shape [0]:
+            nCopy = min (self.chunkSize - self.nBuffered,
+                         block.shape [0] - start)
+            self.buffer [self.nBuffered:self.nBuffered + nCopy] = (
+                block [start:start + nCopy])
+            self.nBuffered = self.nBuffered + nCopy
+            self.nRows = self.nRows + nCopy
+            start = start + nCopy
+            if self.nBuffered == self.chunkSize:
+                self.Flush ()
+        if timing is not None:
+            timing.Stop ('output', startTime)
+
+    def Flush (self):
+        #write out any buffered rows
+        if self.nBuffered > 0:
+            self._WriteChunk (self.buffer [:self.nBuffered])
+            self.nBuffered = 0
+
+    def Close (self):
+        if not self.closed:
+            timing = instrumentation.active
+            if timing is not None:
+                start = timing.Start ()
+            self.Flush ()
+            self._Finish ()
+            self.closed = True
+            if timing is not None:
+                timing.Stop ('output', start)
+
+    def _WriteChunk (self, chunk):
+        raise NotImplementedError
+
+    def _Finish (self):
+        pass
+
+
+class textSink (outputSink):
+    def __init__ (self, fileName, columns, chunkSize = 4096, echoEvery = 0,
+                  intColumns = ()):
+        outputSink.__init__ (self, fileName, columns, chunkSize, echoEvery)
+        self.intColumns = [self.columns.index (name) for name in intColumns]
+        self.outFile = open (fileName, 'w')
+        #output header
+        self.outFile.write (" ".join (self.columns) + "\n")
+
+    def _WriteChunk (self, chunk):
+        rows = chunk.tolist ()
+        for row in rows:
+            for column in self.intColumns:
+                row [column] = int (row [column])
+        self.outFile.write ("".join ([" ".join (map (str, row)) + "\n"
+                                     for row in rows]))
+
+    def _Finish (self):
+        self.outFile.close ()
+
+
+class npySink (outputSink):
+    #space reserved for the .npy header, which is only filled in on closing
+    #   once the number of rows is known
+    headerLength = 128
+
+    def __init__ (self, fileName, columns, chunkSize = 4096, echoEvery = 0):
+        outputSink.__init__ (self, fileName, columns, chunkSize, echoEvery)
+        self.outFile = open (fileName, 'wb')
+        self.outFile.write (b' ' * self.headerLength)
+
+    def _WriteChunk (self, chunk):
+        self.outFile.write (np.ascontiguousarray (chunk, dtype = '<f8').data)
+
+    def _Finish (self):
+        #format version 1.0 header padded to the reserved length
+        header = ("{'descr': '<f8', 'fortran_order': False, 'shape': (" +
+                  str (self.nRows) + ", " + str (len (self.columns)) +
+                  "), }")
+        header = header.ljust (self.headerLength - 11) + "\n"
+        self.outFile.seek (0)
+        self.outFile.write (b'\x93NUMPY\x01\x00' +
+                            struct.pack ('<H', len (header)) +
+                            header.encode ('latin1'))
+        self.outFile.close ()
+        #column names go alongside the data
+        with open (self.fileName + '.columns', 'w') as columnFile:
+            columnFile.write (" ".join (self.columns) + "\n")
+
+
+class compressedSink (outputSink):
+    def __init__ (self, fileName, columns, chunkSize = 65536, echoEvery = 0):
+        outputSink.__init__ (self, fileName, columns, chunkSize, echoEvery)
+        self.archive = zipfile.ZipFile (fileName, 'w',
+                                        compression = zipfile.ZIP_DEFLATED)
+        self.archive.writestr ('columns.txt', " ".join (self.columns) + "\n")
+        self.nChunks = 0
+
+    def _WriteChunk (self, chunk):
+        #each column of each chunk is stored as its own compressed member
+        for column, name in enumerate (self.columns):
+            member = BytesIO ()
+            np.save (member, np.ascontiguousarray (chunk [:, column]))
+            self.archive.writestr ('{0:08d}/{1}.npy'.format (self.nChunks,
+                                                              name),
+                                   member.getvalue ())
+        self.nChunks = self.nChunks + 1
+
+    def _Finish (self):
+        self.archive.close ()
+
+
+def ReadCompressed (fileName, columns = None):
+    #read back a compressedSink file as a dictionary of column arrays
+    with zipfile.ZipFile (fileName) as archive:
+        allColumns = archive.read ('columns.txt').decode ().split ()
+        if columns is None:
+            columns = allColumns
+        nChunks = len ([name for name in archive.namelist ()
+                        if name.endswith ('/' + allColumns [0] + '.npy')])
+        output = {}
+        for name in columns:
+            output [name] = np.concatenate (
+                [np.load (BytesIO (archive.read (
+                    '{0:08d}/{1}.npy'.format (chunk, name))))
+                 for chunk in range (nChunks)] + [np.empty (0)])
+    return output
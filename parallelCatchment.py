@@ -0,0 +1,339 @@
+"""
+
+@author: John Wainwright
+Running large catchments on several cores at once
+The routing network is split into sub-catchments of roughly basinSize
+cells, each ending at a split cell where the flow from upslope has built up
+to that size. Sub-catchments whose inflows come only from sub-catchments
+already finished can be run at the same time, so they are put into levels
+in the same way as the cells of a routingNetwork, and the sub-catchments of
+each level are shared out among the worker processes. The arrays of the
+grid are placed in shared memory, so the only values passed between
+sub-catchments are the overland and subsurface flows of the cells at their
+outlets, read by the cells just downslope once the level above has
+finished. Each cell is updated with exactly the same arithmetic as in the
+serial routing, so the results are identical. If a worker fails (raises
+an error or is killed), Route raises RuntimeError rather than waiting for it
+
+Variables:
+    grid                leakyBucketGrid holding the catchment (its arrays
+                        are moved into shared memory while running)
+    network             routingNetwork linking the cells
+    nWorkers            number of worker processes (None for all cores)
+    basinSize           target number of cells in each sub-catchment
+    basin               sub-catchment of each cell
+    basinLevel          level of each sub-catchment
+    nBasinLevels        number of levels of sub-catchments
+    rainfallRate        rainfall rate in mm/h (scalar or one value per cell)
+    timestep            length of step in hours
+
+"""
+
+import os
+from multiprocessing import Array, Barrier, Process, Value
+from threading import BrokenBarrierError, Event, Thread
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import instrumentation
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+
+sharedArrays = ('satInfilt', 'satInfiltPrime', 'satSoilMoist',
+                'transmissivity', 'depth', 'slope', 'soilMoist', 'infiltRate',
+                'overlandFlow', 'subsurfFlow', 'drainage', 'theta', 'subStep')
+gridSettings = ('integrator', 'tolerance', 'minSubStep', 'prepared',
+                'backend', 'storage')
+
+
+def PartitionBasins (network, basinSize):
+    #returns the sub-catchment of each cell, numbered from 0, and the
+    #   routingNetwork linking the sub-catchments
+    nCells = network.nCells
+    #number of cells draining into each cell that are not already in a
+    #   sub-catchment - a cell becomes a split cell when this reaches
+    #   basinSize
+    unassigned = np.zeros (nCells)
+    isSplit = np.zeros (nCells, dtype = bool)
+    isSplit [network.outlets] = True
+    for thisLevel in range (network.nLevels):
+        cells = network.LevelCells (thisLevel)
+        upslope, segments = network.UpslopeLinks (cells)
+        unassigned [cells] = 1. + np.bincount (
+            segments, unassigned [upslope] * ~isSplit [upslope],
+            minlength = cells.size)
+        isSplit [cells] |= unassigned [cells] >= basinSize
+    #a cell draining into more than one cell ends a sub-catchment too, so
+    #   only the outlet of a sub-catchment has links leaving it (otherwise
+    #   its other receivers could be in a sub-catchment draining back into
+    #   its own)
+    isSplit |= np.diff (network.downslopePtr) > 1
+    #each cell belongs to the sub-catchment of the split cell found
+    #   downslope of it
+    hasDownslope = np.diff (network.downslopePtr) > 0
+    firstDownslope = np.full (nCells, -1, dtype = np.int64)
+    firstDownslope [hasDownslope] = network.downslopeIndex [
+        network.downslopePtr [:-1] [hasDownslope]]
+    basin = np.arange (nCells)
+    for thisLevel in range (network.nLevels - 1, -1, -1):
+        cells = network.LevelCells (thisLevel)
+        inherit = cells [~isSplit [cells]]
+        basin [inherit] = basin [firstDownslope [inherit]]
+    basinIds, basin = np.unique (basin, return_inverse = True)
+    #links between sub-catchments
+    receivers = np.repeat (np.arange (nCells), np.diff (network.upslopePtr))
+    crossing = basin [network.upslopeIndex] != basin [receivers]
+    edges = np.unique (np.stack ((basin [receivers [crossing]],
+                                  basin [network.upslopeIndex [crossing]]),
+                                 axis = 1), axis = 0)
+    upslopeBasins = [[] for thisBasin in range (basinIds.size)]
+    for downslope, upslope in edges:
+        upslopeBasins [downslope].append (upslope)
+    return basin, routingNetwork (upslopeBasins)
+
+
+def _Worker (shmNames, dtypes, nCells, settings, plan, barrier, stop,
+             timestep, counting, clamps, worker):
+    memory = {name: SharedMemory (name = shmName)
+              for name, shmName in shmNames.items ()}
+    grid = leakyBucketGrid (nCells)
+    for name in sharedArrays:
+        setattr (grid, name, np.ndarray ((nCells,), dtype = dtypes [name],
+                                         buffer = memory [name].buf))
+    rainfall = np.ndarray ((nCells,), dtype = float,
+                           buffer = memory ['rainfall'].buf)
+    for name, value in settings.items ():
+        setattr (grid, name, value)
+    try:
+        while True:
+            barrier.wait ()
+            if stop.value:
+                break
+            #instruments of this process, counting the clamps of its cells
+            #   while the main process is instrumented
+            instrumentation.active = (instrumentation.instruments ()
+                                      if counting.value else None)
+            for thisLevel, levelGroups in enumerate (plan):
+                for cells, upslope, segments in levelGroups:
+                    #accumulate runon and inflowing SSF from upslope cells -
+                    #   including outlets of sub-catchments run by other
+                    #   workers
+                    runon = np.bincount (segments, grid.overlandFlow [upslope],
+                                         minlength = cells.size)
+                    subsurfInflow = np.bincount (segments,
+                                                 grid.subsurfFlow [upslope],
+                                                 minlength = cells.size)
+                    grid.UpdateSoilMoist (rainfall [cells], runon,
+                                          subsurfInflow, timestep.value, cells)
+                if (thisLevel == len (plan) - 1 and
+                        instrumentation.active is not None):
+                    counters = instrumentation.active.counters
+                    clamps [2 * worker] = counters ['saturationOverflow']
+                    clamps [2 * worker + 1] = counters ['negativeMoisture']
+                barrier.wait ()
+    except BrokenBarrierError:
+        #another worker (or the main process) has given up
+        pass
+    except BaseException:
+        #break the barrier so nobody waits for this worker any longer
+        barrier.abort ()
+        raise
+    finally:
+        del grid, rainfall
+        for shm in memory.values ():
+            shm.close ()
+
+
+class parallelCatchment:
+    def __init__ (self, grid, network, nWorkers = None, basinSize = None):
+        if grid.budget is not None:
+            raise ValueError ('water budgets are not kept in parallel runs')
+        if nWorkers is None:
+            nWorkers = os.cpu_count ()
+        if basinSize is None:
+            basinSize = max (1, network.nCells // (4 * nWorkers))
+        self.grid = grid
+        self.network = network
+        self.nWorkers = nWorkers
+        self.basin, basinNetwork = PartitionBasins (network, basinSize)
+        self.basinLevel = basinNetwork.level
+        self.nBasinLevels = basinNetwork.nLevels
+        self._Share ()
+        plans = self._Plan (basinNetwork)
+        self.barrier = Barrier (nWorkers + 1)
+        self.stop = Value ('b', False)
+        self.timestep = Value ('d', 0.)
+        self.counting = Value ('b', False)
+        self.clamps = Array ('q', 2 * nWorkers, lock = False)
+        settings = {name: getattr (grid, name) for name in gridSettings}
+        shmNames = {name: shm.name for name, shm in self.memory.items ()}
+        dtypes = {name: getattr (grid, name).dtype.str
+                  for name in sharedArrays}
+        self.workers = [Process (target = _Worker,
+                                 args = (shmNames, dtypes, grid.nCells,
+                                         settings, plans [worker],
+                                         self.barrier, self.stop,
+                                         self.timestep, self.counting,
+                                         self.clamps, worker),
+                                 daemon = True)
+                        for worker in range (nWorkers)]
+        for worker in self.workers:
+            worker.start ()
+        #a worker killed outright cannot break the barrier itself, so it is
+        #   watched from here
+        self.closing = Event ()
+        self.watchdog = Thread (target = self._Watch, daemon = True)
+        self.watchdog.start ()
+
+    def _Watch (self, every = 1.):
+        while not self.closing.wait (every):
+            if not all (worker.is_alive () for worker in self.workers):
+                self.barrier.abort ()
+                return
+
+    def _Share (self):
+        #move the arrays of the grid into shared memory (keeping the
+        #   precision they are stored in)
+        nCells = self.grid.nCells
+        self.memory = {}
+        for name in sharedArrays + ('rainfall',):
+            if name == 'rainfall':
+                dtype = np.dtype (float)
+            else:
+                dtype = getattr (self.grid, name).dtype
+            self.memory [name] = SharedMemory (
+                create = True, size = max (dtype.itemsize * nCells, 1))
+            shared = np.ndarray ((nCells,), dtype = dtype,
+                                 buffer = self.memory [name].buf)
+            if name == 'rainfall':
+                self.rainfall = shared
+            else:
+                shared [:] = getattr (self.grid, name)
+                setattr (self.grid, name, shared)
+
+    def _Plan (self, basinNetwork):
+        #for each worker and level of sub-catchments, the groups of cells
+        #   (one per level of cells) it updates, with their upslope links
+        basinCells = np.bincount (self.basin)
+        basinWorker = np.empty (basinCells.size, dtype = np.int64)
+        for thisLevel in range (self.nBasinLevels):
+            load = np.zeros (self.nWorkers)
+            basins = basinNetwork.LevelCells (thisLevel)
+            for thisBasin in basins [np.argsort (-basinCells [basins])]:
+                basinWorker [thisBasin] = np.argmin (load)
+                load [basinWorker [thisBasin]] += basinCells [thisBasin]
+        cellWorker = basinWorker [self.basin]
+        cellBasinLevel = self.basinLevel [self.basin]
+        order = np.lexsort ((self.network.level, cellBasinLevel, cellWorker))
+        plans = [[[] for thisLevel in range (self.nBasinLevels)]
+                 for worker in range (self.nWorkers)]
+        keys = np.stack ((cellWorker [order], cellBasinLevel [order],
+                          self.network.level [order]))
+        starts = np.flatnonzero (np.any (np.diff (keys, axis = 1) != 0,
+                                         axis = 0)) + 1
+        for cells in np.split (order, starts):
+            if cells.size == 0:
+                continue
+            upslope, segments = self.network.UpslopeLinks (cells)
+            plans [cellWorker [cells [0]]] [cellBasinLevel [cells [0]]].append (
+                (cells, upslope, segments))
+        return plans
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, excType, excValue, traceback):
+        self.Close ()
+
+    def Route (self, rainfallRate, timestep):
+        #advance every cell by one timestep
+        timing = instrumentation.active
+        if timing is not None:
+            start = timing.Start ()
+        self.rainfall [:] = rainfallRate
+        self.timestep.value = timestep
+        self.counting.value = timing is not None
+        try:
+            self.barrier.wait ()
+            for thisLevel in range (self.nBasinLevels):
+                self.barrier.wait ()
+        except BrokenBarrierError:
+            raise RuntimeError ('a worker process failed (exit codes ' +
+                                str ([worker.exitcode
+                                      for worker in self.workers]) +
+                                '); the grid is left part-way through a '
+                                'step') from None
+        if timing is not None:
+            #the workers' own split between phases is not seen from here
+            timing.Stop ('update', start)
+            timing.CountUpdates (self.grid)
+            clamps = np.array (self.clamps [:])
+            timing.CountClamps (clamps [0::2].sum (), clamps [1::2].sum ())
+            timing.EndStep ()
+
+    def Close (self):
+        #stop the workers and give the grid back ordinary arrays
+        if self.workers:
+            self.closing.set ()
+            self.stop.value = True
+            try:
+                self.barrier.wait ()
+            except BrokenBarrierError:
+                #a worker failed - any still running have stopped waiting
+                pass
+            for worker in self.workers:
+                worker.join ()
+            self.workers = []
+            for name in sharedArrays:
+                setattr (self.grid, name, np.array (getattr (self.grid, name)))
+            self.rainfall = None
+            for shm in self.memory.values ():
+                shm.close ()
+                shm.unlink ()
+
+if __name__ == '__main__':
+    import time as timer
+
+    from benchmark import MakeLandscape
+
+    #a catchment of parallel hillslopes draining to a channel, run serially
+    #   and in parallel
+    nCells = 200000
+    parameters, upslopeCells = MakeLandscape (nCells, hillslopeLength = 100)
+    channel = np.arange (99, nCells, 100)
+    for downslope, upslope in zip (channel [1:], channel [:-1]):
+        upslopeCells [downslope].append (upslope)
+    network = routingNetwork (upslopeCells)
+    serial = leakyBucketGrid (nCells, *parameters)
+    startTime = timer.perf_counter ()
+    for time in range (0, 60):
+        network.Route (serial, 20., 1. / 60.)
+    print ('serial', timer.perf_counter () - startTime, 's')
+    grid = leakyBucketGrid (nCells, *parameters)
+    with parallelCatchment (grid, network, nWorkers = 4) as catchment:
+        startTime = timer.perf_counter ()
+        for time in range (0, 60):
+            catchment.Route (20., 1. / 60.)
+        print ('parallel', timer.perf_counter () - startTime, 's with',
+               catchment.nBasinLevels, 'levels of sub-catchments')
+    print ('identical:', np.array_equal (grid.soilMoist, serial.soilMoist) and
+           np.array_equal (grid.overlandFlow, serial.overlandFlow) and
+           np.array_equal (grid.subsurfFlow, serial.subsurfFlow))
+    #random networks in which cells may drain into several cells
+    rng = np.random.default_rng (1)
+    for thisNetwork in range (300):
+        upslopeCells = [list (np.flatnonzero (rng.random (cell) < 0.15))
+                        for cell in range (30)]
+        for basinSize in (2, 3, 5):
+            PartitionBasins (routingNetwork (upslopeCells), basinSize)
+    network = routingNetwork (upslopeCells)
+    serial = leakyBucketGrid (30, 5., 0.04, 0.38, 10., 500., 5.)
+    grid = leakyBucketGrid (30, 5., 0.04, 0.38, 10., 500., 5.)
+    with parallelCatchment (grid, network, nWorkers = 2,
+                            basinSize = 3) as catchment:
+        for time in range (0, 60):
+            network.Route (serial, 20., 1. / 60.)
+            catchment.Route (20., 1. / 60.)
+    print ('300 random networks partitioned, identical:',
+           np.array_equal (grid.soilMoist, serial.soilMoist))
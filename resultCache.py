@@ -0,0 +1,249 @@
+"""
+
+@author: John Wainwright
+Cache of model results on disk
+Calibration and teaching runs repeat the same hillslope experiments with
+the same parameters and rainfall again and again. Each set of results is
+stored under a key that is a hash of everything that went into the run -
+the name, data type, shape and exact bytes of every input, plus the model
+version - so a run with exactly the same inputs finds its results without
+running the model, and any change to an input (even in the last bit) gives
+a different key. Every entry is a directory of .npy files (which can be
+memory-mapped straight back in) and a small JSON file, written to a
+temporary directory that is then renamed into place, as in checkpoint.py.
+The cache is kept below maxBytes by removing the least recently used
+entries. The model version is modelVersion together with a hash of the
+source of the model modules, so editing the model gives new keys, and
+entries left by any other version are removed when the cache is opened
+
+Variables:
+    path                directory holding the cache
+    maxBytes            largest total size of the entries in bytes
+    version             model version (ModelVersion () unless given)
+    key                 key of an entry (hexadecimal hash of its inputs)
+    results             dictionary of name: array stored for an entry
+    mmap                memory-map arrays on reading (read-only, so the
+                        cache itself is never changed)
+    hits                number of runs found in the cache
+    misses              number of runs that were not
+
+    inputs of RunHillslope (as in simpleHillslope-2.py)
+    rainfall            rainfall rate in mm/h - constant, or one value per
+                        timestep
+    stormLength         number of timesteps
+    timestep            length of each step in hours
+    nCells              number of cells in the catena
+    initialSatInfilt    ... initialSlope as for leakyBucketGrid
+
+    outputs of RunHillslope
+    time                time of each step in h
+    soilMoist, overlandFlow, subsurfFlow, drainage
+                        series at the bottom cell, one value per step
+    finalSoilMoist, finalOverlandFlow, finalSubsurfFlow, finalDrainage
+                        state of every cell at the end
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time as timer
+
+import numpy as np
+
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+
+#increase when the results of the model change in a way the source hash
+#   would not show (e.g. a change in a library it depends on)
+modelVersion = 1
+modelFiles = ('leakyBucketGrid.py', 'routingNetwork.py', 'resultCache.py')
+seriesNames = ('soilMoist', 'overlandFlow', 'subsurfFlow', 'drainage')
+finalNames = ('finalSoilMoist', 'finalOverlandFlow', 'finalSubsurfFlow',
+              'finalDrainage')
+
+
+def ModelVersion ():
+    #modelVersion and a hash of the source of the model modules
+    digest = hashlib.sha256 ()
+    folder = os.path.dirname (os.path.abspath (__file__))
+    for fileName in modelFiles:
+        with open (os.path.join (folder, fileName), 'rb') as sourceFile:
+            digest.update (sourceFile.read ())
+    return str (modelVersion) + '-' + digest.hexdigest () [:16]
+
+
+def _Touch (headerName):
+    #mark an entry as just used - the time is set to the nanosecond, as the
+    #   file system may only keep the time it was written to the nearest
+    #   few milliseconds
+    now = timer.time_ns ()
+    os.utime (headerName, ns = (now, now))
+
+
+class resultCache:
+    def __init__ (self, path, maxBytes = 2 ** 30, version = None):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.version = ModelVersion () if version is None else version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs (path, exist_ok = True)
+        self.Prune ()
+
+    def Key (self, **inputs):
+        #hash of the version and the exact value of every input
+        digest = hashlib.sha256 (self.version.encode ())
+        for name in sorted (inputs):
+            value = np.ascontiguousarray (inputs [name])
+            digest.update (json.dumps ([name, value.dtype.str,
+                                        value.shape]).encode ())
+            digest.update (value.tobytes ())
+        return digest.hexdigest ()
+
+    def _Entries (self):
+        #complete entries as (last used, size in bytes, directory, version)
+        entries = []
+        for name in os.listdir (self.path):
+            entryPath = os.path.join (self.path, name)
+            headerName = os.path.join (entryPath, 'entry.json')
+            if name.endswith ('.tmp') or not os.path.exists (headerName):
+                continue
+            with open (headerName) as headerFile:
+                header = json.load (headerFile)
+            entries.append ((os.stat (headerName).st_mtime_ns,
+                             header ['bytes'], entryPath, header ['version']))
+        return entries
+
+    def Get (self, key, mmap = True):
+        #the results stored under key (None if there are none)
+        entryPath = os.path.join (self.path, key)
+        headerName = os.path.join (entryPath, 'entry.json')
+        try:
+            with open (headerName) as headerFile:
+                header = json.load (headerFile)
+            results = {name: np.load (os.path.join (entryPath, name + '.npy'),
+                                      mmap_mode = 'r' if mmap else None)
+                       for name in header ['names']}
+            _Touch (headerName)
+        except (FileNotFoundError, ValueError):
+            #not cached, or removed part-way through reading
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return results
+
+    def Put (self, key, results):
+        #store results under key, then make room for them
+        entryPath = os.path.join (self.path, key)
+        tempPath = entryPath + '.tmp'
+        if os.path.exists (tempPath):
+            shutil.rmtree (tempPath)
+        os.makedirs (tempPath)
+        size = 0
+        for name, values in results.items ():
+            fileName = os.path.join (tempPath, name + '.npy')
+            np.save (fileName, np.asarray (values))
+            size = size + os.path.getsize (fileName)
+        with open (os.path.join (tempPath, 'entry.json'), 'w') as headerFile:
+            json.dump ({'version': self.version, 'names': list (results),
+                        'bytes': size, 'created': timer.time ()}, headerFile)
+        _Touch (os.path.join (tempPath, 'entry.json'))
+        if os.path.exists (entryPath):
+            #already stored (e.g. by another process)
+            shutil.rmtree (tempPath)
+        else:
+            os.rename (tempPath, entryPath)
+        self.Evict ()
+
+    def Evict (self):
+        #remove the least recently used entries until the cache fits
+        entries = sorted (self._Entries ())
+        total = sum (entry [1] for entry in entries)
+        while entries and total > self.maxBytes:
+            lastUsed, size, entryPath, version = entries.pop (0)
+            shutil.rmtree (entryPath, ignore_errors = True)
+            total = total - size
+
+    def Prune (self):
+        #remove entries from other model versions and unfinished entries
+        for name in os.listdir (self.path):
+            if name.endswith ('.tmp'):
+                shutil.rmtree (os.path.join (self.path, name),
+                               ignore_errors = True)
+        for lastUsed, size, entryPath, version in self._Entries ():
+            if version != self.version:
+                shutil.rmtree (entryPath, ignore_errors = True)
+
+    def Clear (self):
+        for lastUsed, size, entryPath, version in self._Entries ():
+            shutil.rmtree (entryPath, ignore_errors = True)
+
+    def Size (self):
+        return sum (entry [1] for entry in self._Entries ())
+
+
+def RunHillslope (rainfall = 20., stormLength = 60, timestep = 1. / 60.,
+                  nCells = 3, initialSatInfilt = 5., initialSoilMoist = 0.04,
+                  initialSatSoilMoist = 0.38, initialTransmissivity = 10.,
+                  initialDepth = 500., initialSlope = 5., cache = None):
+    #the catena of simpleHillslope-2.py, returning the series at the bottom
+    #   cell and the final state of every cell - from the cache if these
+    #   inputs have been run before
+    rainfall = np.broadcast_to (np.asarray (rainfall, dtype = float),
+                                (stormLength,))
+    parameters = np.array ([initialSatInfilt, initialSoilMoist,
+                            initialSatSoilMoist, initialTransmissivity,
+                            initialDepth, initialSlope], dtype = float)
+    if cache is not None:
+        key = cache.Key (rainfall = rainfall, timestep = float (timestep),
+                         nCells = int (nCells), parameters = parameters)
+        results = cache.Get (key)
+        if results is not None:
+            return results
+    grid = leakyBucketGrid (nCells, *parameters)
+    network = routingNetwork ([[]] + [[cell] for cell in range (nCells - 1)])
+    series = np.zeros ((len (seriesNames), stormLength))
+    for time in range (0, stormLength):
+        network.Route (grid, rainfall [time], timestep)
+        for i, name in enumerate (seriesNames):
+            series [i, time] = getattr (grid, name) [-1]
+    results = {'time': np.arange (stormLength) * timestep}
+    for i, name in enumerate (seriesNames):
+        results [name] = series [i]
+    for name, finalName in zip (seriesNames, finalNames):
+        results [finalName] = getattr (grid, name).copy ()
+    if cache is not None:
+        cache.Put (key, results)
+    return results
+
+if __name__ == '__main__':
+    #repeat the simpleHillslope-2.py storm for three infiltration rates,
+    #   twice, in a cache small enough to hold only three of the runs
+    cache = resultCache ('resultCache', maxBytes = 3 * 4000)
+    cache.Clear ()
+    for repeat in range (2):
+        startTime = timer.perf_counter ()
+        for satInfilt in (2., 5., 10.):
+            results = RunHillslope (initialSatInfilt = satInfilt,
+                                    cache = cache)
+        print ('pass', repeat, timer.perf_counter () - startTime, 's,',
+               cache.hits, 'hits', cache.misses, 'misses,', cache.Size (),
+               'bytes')
+    #two new runs push out the two least recently used
+    for satInfilt in (15., 20.):
+        RunHillslope (initialSatInfilt = satInfilt, cache = cache)
+    for satInfilt in (10., 2.):
+        hits = cache.hits
+        RunHillslope (initialSatInfilt = satInfilt, cache = cache)
+        print (satInfilt, 'mm/h still cached:', cache.hits > hits)
+    #cached results are the same as a fresh run
+    cached = RunHillslope (initialSatInfilt = 20., cache = cache)
+    fresh = RunHillslope (initialSatInfilt = 20.)
+    print ('identical to a fresh run:',
+           all (np.array_equal (cached [name], fresh [name])
+                for name in fresh))
+    #another model version never sees these entries
+    print ('entries left for another version:',
+           len (resultCache ('resultCache', version = 'other')._Entries ()))
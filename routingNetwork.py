@@ -0,0 +1,222 @@
+"""
+
+@author: John Wainwright
+Flow-routing network for landscapes of leaky bucket cells
+Built once from the upslope links of each cell (the same information as the
+upslopeCells lists used in simpleHillslope-2.py), it works out a topological
+order so that every cell is updated after all the cells that drain into it,
+whatever order the cells were listed in. Cells are grouped into levels (a
+cell's level is one more than the highest level upslope of it) and the runon
+and subsurface inflow to a whole level are accumulated with segmented sums
+(or, with grid.backend = 'numba', the cells are run in order in a single
+compiled loop - see compiledBackend.py)
+
+Variables:
+    Used to initialize the class
+    upslopeCells        list with, for each cell, a list of the indices of
+                        the cells upslope of it
+
+    variables describing the network
+    nCells              number of cells in the network
+    upslopePtr          CSR pointer array - the upslope cells of cell i are
+                        upslopeIndex [upslopePtr [i]:upslopePtr [i + 1]]
+    upslopeIndex        CSR index array of upslope cells
+    downslopePtr        CSR pointer array of the reversed (downslope) links
+    downslopeIndex      CSR index array of downslope cells
+    level               level of each cell (0 for cells with nothing upslope)
+    order               cell indices sorted by level
+    levelPtr            cells in level k are order [levelPtr [k]:levelPtr [k + 1]]
+    outlets             indices of cells with nothing downslope
+    nLevels             number of levels in the network
+
+    variables used in routing
+    grid                leakyBucketGrid holding the cells in the network
+    rainfallRate        rainfall rate in mm/h (scalar or one value per cell)
+    timestep            length of step in hours
+
+"""
+
+import numpy as np
+
+import compiledBackend
+import instrumentation
+
+
+class routingNetwork:
+    def __init__ (self, upslopeCells):
+        self.nCells = len (upslopeCells)
+        #store the upslope links as CSR-style arrays
+        counts = np.array ([len (links) for links in upslopeCells],
+                           dtype = np.int64)
+        self.upslopePtr = np.zeros (self.nCells + 1, dtype = np.int64)
+        np.cumsum (counts, out = self.upslopePtr [1:])
+        self.upslopeIndex = np.fromiter (
+            (cell for links in upslopeCells for cell in links),
+            dtype = np.int64, count = self.upslopePtr [-1])
+        self._Build ()
+
+    @classmethod
+    def FromCells (cls, cells):
+        #build the network from the upslopeCells lists of leakyBucket objects
+        return cls ([cell.upslopeCells for cell in cells])
+
+    @classmethod
+    def FromCSR (cls, upslopePtr, upslopeIndex):
+        #build the network from CSR arrays of upslope links (for example
+        #   those stored in a checkpoint)
+        network = cls.__new__ (cls)
+        network.nCells = len (upslopePtr) - 1
+        network.upslopePtr = np.asarray (upslopePtr, dtype = np.int64)
+        network.upslopeIndex = np.asarray (upslopeIndex, dtype = np.int64)
+        network._Build ()
+        return network
+
+    def _Build (self):
+        counts = np.diff (self.upslopePtr)
+        if (np.any (self.upslopeIndex < 0) or
+                np.any (self.upslopeIndex >= self.nCells)):
+            raise ValueError ('upslope cell index out of range')
+        #receiving cell of each link
+        self._linkTarget = np.repeat (np.arange (self.nCells), counts)
+        #reversed links so we can walk downslope when ordering the cells
+        linkOrder = np.argsort (self.upslopeIndex, kind = 'stable')
+        self.downslopeIndex = self._linkTarget [linkOrder]
+        self.downslopePtr = np.zeros (self.nCells + 1, dtype = np.int64)
+        np.cumsum (np.bincount (self.upslopeIndex, minlength = self.nCells),
+                   out = self.downslopePtr [1:])
+        self._ComputeLevels (counts)
+        self.outlets = np.flatnonzero (np.diff (self.downslopePtr) == 0)
+        self._PrepareLevels ()
+
+    def _ComputeLevels (self, counts):
+        #Kahn's algorithm, advancing a whole frontier of cells at a time
+        self.level = np.full (self.nCells, -1, dtype = np.int64)
+        remaining = counts.copy ()
+        frontier = np.flatnonzero (remaining == 0)
+        thisLevel = 0
+        nDone = 0
+        while frontier.size > 0:
+            self.level [frontier] = thisLevel
+            nDone = nDone + frontier.size
+            #all the links leaving the frontier
+            starts = self.downslopePtr [frontier]
+            lengths = self.downslopePtr [frontier + 1] - starts
+            links = (np.repeat (starts - np.cumsum (lengths) + lengths,
+                                lengths) + np.arange (lengths.sum ()))
+            receivers = self.downslopeIndex [links]
+            np.subtract.at (remaining, receivers, 1)
+            frontier = np.unique (receivers [remaining [receivers] == 0])
+            thisLevel = thisLevel + 1
+        if nDone < self.nCells:
+            raise ValueError ('routing network contains a cycle through cells ' +
+                              str (np.flatnonzero (self.level < 0) [:10]))
+        self.nLevels = thisLevel
+
+    def _PrepareLevels (self):
+        #order the cells by level and, for each level, gather the upslope
+        #   links of its cells into one flat array with a segment id for
+        #   each link so that inflows can be summed with bincount
+        self.order = np.argsort (self.level, kind = 'stable')
+        self.levelPtr = np.searchsorted (self.level [self.order],
+                                         np.arange (self.nLevels + 1))
+        self._levelLinks = []
+        self._levelSegments = []
+        for thisLevel in range (self.nLevels):
+            upslope, segments = self.UpslopeLinks (self.LevelCells (thisLevel))
+            self._levelLinks.append (upslope)
+            self._levelSegments.append (segments)
+
+    def UpslopeLinks (self, cells):
+        #the cells upslope of each of the given cells, as one flat array
+        #   along with the position in cells each link belongs to
+        starts = self.upslopePtr [cells]
+        lengths = self.upslopePtr [cells + 1] - starts
+        links = (np.repeat (starts - np.cumsum (lengths) + lengths, lengths) +
+                 np.arange (lengths.sum ()))
+        return (self.upslopeIndex [links],
+                np.repeat (np.arange (len (cells)), lengths))
+
+    def LevelCells (self, thisLevel):
+        #indices of the cells in one level
+        return self.order [self.levelPtr [thisLevel]:
+                           self.levelPtr [thisLevel + 1]]
+
+    def Route (self, grid, rainfallRate, timestep):
+        #advance every cell in the grid by one timestep, level by level
+        rainfallRate = np.asarray (rainfallRate, dtype = float)
+        timing = instrumentation.active
+        if (grid.backend == 'numba' and grid.integrator == 'euler' and
+                grid.budget is None and compiledBackend.Available ()):
+            #one compiled loop over the cells in order
+            if timing is not None:
+                start = timing.Start ()
+            compiledBackend.Route (self, grid, rainfallRate, timestep)
+            if timing is not None:
+                timing.Stop ('update', start)
+                timing.CountUpdates (grid)
+                timing.EndStep ()
+            return
+        for thisLevel in range (self.nLevels):
+            cells = self.LevelCells (thisLevel)
+            if rainfallRate.ndim > 0:
+                rain = rainfallRate [cells]
+            else:
+                rain = rainfallRate
+            if thisLevel == 0:
+                #nothing upslope of these cells so zero runon and subsurf inflow
+                grid.UpdateSoilMoist (rain, 0., 0., timestep, cells)
+                continue
+            #accumulate runon and inflowing SSF from upslope cells
+            if timing is not None:
+                start = timing.Start ()
+            upslope = self._levelLinks [thisLevel]
+            segments = self._levelSegments [thisLevel]
+            runon = np.bincount (segments, grid.overlandFlow [upslope],
+                                 minlength = cells.size)
+            subsurfInflow = np.bincount (segments, grid.subsurfFlow [upslope],
+                                         minlength = cells.size)
+            if timing is not None:
+                timing.Stop ('accumulation', start)
+            grid.UpdateSoilMoist (rain, runon, subsurfInflow, timestep, cells)
+        if grid.budget is not None:
+            grid.budget.EndStep (timestep)
+        if timing is not None:
+            timing.EndStep ()
+
+if __name__ == '__main__':
+    from leakyBucket import leakyBucket
+    from leakyBucketGrid import leakyBucketGrid
+
+    #same three-cell catena as simpleHillslope-2.py but listed bottom-up, so
+    #   the serial loop over the list would be wrong without a sorted order
+    rainfall = 20. #20 mm/h
+    finalInfiltRate = 5. #5 mm/h so should produce HOF
+    soilMoist = 0.04 #assumes dry soil
+    satSoilMoist = 0.38 #assumes 0.38 m/m saturated content
+    transmissivity = 10.
+    depth = 500.
+    slope = 5. #degress - converted in the init
+    stormLength = 60
+    timestep = 1. / 60. #in hours
+    catena = []
+    for i in range (0, 3):
+        catena.append (leakyBucket (finalInfiltRate, soilMoist, satSoilMoist,
+                                    transmissivity, depth, slope))
+    catena [0].upslopeCells.append (1)
+    catena [1].upslopeCells.append (2)
+    grid = leakyBucketGrid.FromCells (catena)
+    network = routingNetwork.FromCells (catena)
+    for time in range (0, stormLength):
+        for thisSoil in reversed (catena):
+            runon = 0.
+            subsurfInflow = 0.
+            for upslope in thisSoil.upslopeCells:
+                runon = runon + catena [upslope].overlandFlow
+                subsurfInflow = subsurfInflow + catena [upslope].subsurfFlow
+            thisSoil.UpdateSoilMoist (rainfall, runon, subsurfInflow, timestep)
+        network.Route (grid, rainfall, timestep)
+    print ('Outlets', network.outlets, 'levels', network.nLevels)
+    print ('Soil moisture', grid.soilMoist,
+           [thisSoil.soilMoist for thisSoil in catena])
+    print ('Overland flow', grid.overlandFlow,
+           [thisSoil.overlandFlow for thisSoil in catena])
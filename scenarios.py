@@ -0,0 +1,196 @@
+"""
+
+@author: John Wainwright
+Many rainfall scenarios on one landscape
+The landscape and its routing network are built once. To run a batch of
+scenarios, the cells are repeated along an extra axis - cell c of scenario
+s is element s * nCells + c of the arrays of one stacked leakyBucketGrid,
+so grid.soilMoist.reshape (nScenarios, nCells) has one row per scenario -
+and the routing network is repeated in the same way, so every scenario of
+the batch is advanced in the same vectorised pass. The initial state is
+kept once, as the arrays of the landscape itself, and copied into every
+row at the start of each batch rather than building the cells again. Each
+scenario is summarised on the fly at the output cells (the outlets by
+default) as in ensemble.py, so nothing is kept per timestep
+
+Variables:
+    grid                leakyBucketGrid holding the landscape (with its
+                        initial state)
+    network             routingNetwork linking the cells
+    nScenarios          number of scenarios run together in a batch
+    rainfall            rainfall rates in mm/h, one row per timestep and one
+                        column per scenario (or a third axis with one value
+                        per cell for distributed rainfall)
+    timestep            length of each step in hours
+    outputCells         cells summarised in each scenario
+    intensities         design storm rainfall intensities in mm/h
+    durations           design storm durations in h
+
+    summary outputs (one value per scenario and output cell)
+    peakOverlandFlow    peak rate of overland flow in mm/h
+    timeToPeak          time of the peak in h
+    runoffVolume        total overland flow in mm
+    finalSoilMoist      soil moisture at the end in mm
+
+"""
+
+import numpy as np
+
+from leakyBucketGrid import leakyBucketGrid
+from routingNetwork import routingNetwork
+from streamStats import monitor, peakValue, runningTotal
+
+stackedArrays = ('satInfilt', 'satInfiltPrime', 'satSoilMoist',
+                 'transmissivity', 'depth', 'slope')
+stateArrays = ('soilMoist', 'infiltRate', 'overlandFlow', 'subsurfFlow',
+               'drainage', 'theta', 'subStep')
+gridSettings = ('integrator', 'tolerance', 'minSubStep', 'prepared', 'backend')
+summaryNames = ('peakOverlandFlow', 'timeToPeak', 'runoffVolume',
+                'finalSoilMoist')
+
+
+def StackNetwork (network, nCopies):
+    #nCopies unconnected copies of a network, copy s holding cells
+    #   s * nCells to (s + 1) * nCells - 1
+    nLinks = network.upslopeIndex.size
+    offsets = np.arange (nCopies)
+    upslopePtr = np.concatenate ((
+        (network.upslopePtr [:-1] + nLinks * offsets [:, np.newaxis]).ravel (),
+        [nCopies * nLinks]))
+    upslopeIndex = (network.upslopeIndex +
+                    network.nCells * offsets [:, np.newaxis]).ravel ()
+    return routingNetwork.FromCSR (upslopePtr, upslopeIndex)
+
+
+def DesignStorms (intensities, durations, timestep, nSteps = None):
+    #every combination of intensity and duration, as a rainfall array with
+    #   one column per storm (each starting at time 0), and a table of the
+    #   intensity and duration of each column
+    intensity, duration = np.meshgrid (np.asarray (intensities, dtype = float),
+                                       np.asarray (durations, dtype = float),
+                                       indexing = 'ij')
+    intensity = intensity.ravel ()
+    duration = duration.ravel ()
+    stormSteps = np.rint (duration / timestep).astype (np.int64)
+    if nSteps is None:
+        nSteps = int (stormSteps.max (initial = 0))
+    rainfall = np.where (np.arange (nSteps) [:, np.newaxis] < stormSteps,
+                         intensity, 0.)
+    table = np.zeros (intensity.size, dtype = [('intensity', float),
+                                               ('duration', float)])
+    table ['intensity'] = intensity
+    table ['duration'] = duration
+    return rainfall, table
+
+
+class scenarioRunner:
+    def __init__ (self, grid, network, nScenarios, outputCells = None):
+        if outputCells is None:
+            outputCells = network.outlets
+        self.landscape = grid
+        self.nCells = grid.nCells
+        self.nScenarios = nScenarios
+        self.outputCells = np.asarray (outputCells).reshape (-1)
+        self.grid = leakyBucketGrid (nScenarios * grid.nCells,
+                                     storage = grid.storage)
+        for name in stackedArrays:
+            setattr (self.grid, name, np.tile (getattr (grid, name),
+                                               nScenarios))
+        for name in gridSettings:
+            setattr (self.grid, name, getattr (grid, name))
+        self.network = StackNetwork (network, nScenarios)
+        #output cells of every scenario, scenario by scenario
+        self.stackedOutputs = (self.outputCells + self.nCells *
+                               np.arange (nScenarios) [:, np.newaxis]).ravel ()
+
+    def Reset (self):
+        #put every scenario back to the state of the landscape
+        for name in stateArrays:
+            getattr (self.grid, name).reshape (self.nScenarios,
+                                               self.nCells) [:] = getattr (
+                                                   self.landscape, name)
+        self.grid._constants = None
+
+    def Run (self, rainfall, timestep):
+        #run up to nScenarios scenarios from the initial state, returning a
+        #   dictionary of summary arrays (one row per scenario, one column
+        #   per output cell)
+        rainfall = np.asarray (rainfall, dtype = float)
+        nRun = rainfall.shape [1]
+        if nRun > self.nScenarios:
+            raise ValueError ('batch of ' + str (nRun) + ' scenarios but ' +
+                              'only ' + str (self.nScenarios) +
+                              ' fit in the runner')
+        self.Reset ()
+        overlandFlow = monitor (self.grid, 'overlandFlow', self.stackedOutputs,
+                                {'peak': peakValue (np.zeros (
+                                    self.stackedOutputs.size)),
+                                 'total': runningTotal ()})
+        #spare scenarios in a short batch get no rain
+        stepRain = np.zeros ((self.nScenarios, self.nCells))
+        for time in range (rainfall.shape [0]):
+            if rainfall.ndim == 2:
+                stepRain [:nRun] = rainfall [time] [:, np.newaxis]
+            else:
+                stepRain [:nRun] = rainfall [time]
+            self.network.Route (self.grid, stepRain.reshape (-1), timestep)
+            overlandFlow.Step (time * timestep, timestep)
+        results = overlandFlow.Results ()
+        shape = (self.nScenarios, self.outputCells.size)
+        summary = {'peakOverlandFlow': results ['peak'] ['peak'],
+                   'timeToPeak': results ['peak'] ['timeToPeak'],
+                   'runoffVolume': results ['total'] ['total'],
+                   'finalSoilMoist': self.grid.soilMoist [self.stackedOutputs]}
+        return {name: np.reshape (values, shape) [:nRun].copy ()
+                for name, values in summary.items ()}
+
+
+def RunScenarios (grid, network, rainfall, timestep, outputCells = None,
+                  batchSize = 256):
+    #run every scenario (column of rainfall) in batches of batchSize, all
+    #   using the same stacked landscape
+    rainfall = np.asarray (rainfall, dtype = float)
+    runner = scenarioRunner (grid, network,
+                             min (batchSize, rainfall.shape [1]), outputCells)
+    batches = [runner.Run (rainfall [:, start:start + runner.nScenarios],
+                           timestep)
+               for start in range (0, rainfall.shape [1], runner.nScenarios)]
+    return {name: np.concatenate ([batch [name] for batch in batches])
+            for name in summaryNames}
+
+if __name__ == '__main__':
+    import time as timer
+
+    from leakyBucket import leakyBucket
+
+    #a design-storm table for the catena of simpleHillslope-2.py: 20
+    #   intensities by 20 durations, each run for three hours
+    timestep = 1. / 60.
+    grid = leakyBucketGrid (3, 5., 0.04, 0.38, 10., 500., 5.)
+    network = routingNetwork ([[], [0], [1]])
+    rainfall, table = DesignStorms (np.linspace (5., 100., 20),
+                                    np.linspace (0.25, 2., 20), timestep,
+                                    nSteps = 180)
+    startTime = timer.perf_counter ()
+    results = RunScenarios (grid, network, rainfall, timestep)
+    print (len (table), 'design storms in', timer.perf_counter () - startTime,
+           's')
+    for row in range (0, len (table), 57):
+        print ('{0:6.1f} mm/h for {1:5.2f} h: peak {2:8.3f} mm/h at {3:5.2f} h,'
+               ' runoff {4:8.3f} mm'.format (
+                   table ['intensity'] [row], table ['duration'] [row],
+                   results ['peakOverlandFlow'] [row, 0],
+                   results ['timeToPeak'] [row, 0],
+                   results ['runoffVolume'] [row, 0]))
+    #one storm checked against a catena of leakyBucket objects
+    row = 250
+    catena = [leakyBucket (5., 0.04, 0.38, 10., 500., 5.) for cell in range (3)]
+    for time in range (0, 180):
+        for cell, thisSoil in enumerate (catena):
+            upslope = catena [cell - 1] if cell > 0 else None
+            thisSoil.UpdateSoilMoist (
+                rainfall [time, row],
+                upslope.overlandFlow if upslope else 0.,
+                upslope.subsurfFlow if upslope else 0., timestep)
+    print ('difference from leakyBucket:',
+           results ['finalSoilMoist'] [row, 0] - catena [2].soilMoist)
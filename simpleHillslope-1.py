@@ -4,9 +4,8 @@
 @author: John Wainwright
 linking several 1-D leaky bucket models together to simulate a small hillslope
 """
-import matplotlib.pyplot as plt
-
 from leakyBucket import leakyBucket
+from modelPlots import GetPyplot, ShowFigure
 
 if __name__ == '__main__':
 #simple test with constant rainfall rate
@@ -51,7 +50,8 @@ if __name__ == '__main__':
         #look at downslope patterns of soil moisture
         print (time, soil1.soilMoist, soil2.soilMoist, soil3.soilMoist)
     
-    # plot results
+    # plot results (run with --headless to save them to file instead)
+    plt = GetPyplot ()
     fig, ax = plt.subplots ()
     # create a line using rainfall data
     line1, = ax.plot (timeOut, rainOut, label = 'rainfall')
@@ -65,4 +65,4 @@ if __name__ == '__main__':
     plt.xlabel ('time  [h]')
     plt.ylabel ('rate [mm/h]')
     ax.legend ()
-    plt.show ()
\ No newline at end of file
+    ShowFigure (fig, "simpleHillslope1Results.png")
\ No newline at end of file
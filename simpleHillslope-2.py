@@ -4,9 +4,8 @@
 @author: John Wainwright
 linking several 1-D leaky bucket models together to simulate a small hillslope
 """
-import matplotlib.pyplot as plt
-
 from leakyBucket import leakyBucket
+from modelPlots import GetPyplot, ShowFigure
 
 if __name__ == '__main__':
 #simple test with constant rainfall rate
@@ -53,7 +52,8 @@ if __name__ == '__main__':
         #look at downslope patterns of soil moisture
         print (time, soil1.soilMoist, soil2.soilMoist, soil3.soilMoist)
     
-    # plot results
+    # plot results (run with --headless to save them to file instead)
+    plt = GetPyplot ()
     fig, ax = plt.subplots ()
     # create a line using rainfall data
     line1, = ax.plot (timeOut, rainOut, label = 'rainfall')
@@ -67,8 +67,7 @@ if __name__ == '__main__':
     plt.xlabel ('time  [h]')
     plt.ylabel ('rate [mm/h]')
     ax.legend ()
-    plt.draw ()        
-    plt.pause (0.001)
+    ShowFigure (fig, "simpleHillslope2Results.png", block = False)
     
     #alternative implementation as a list of cells
     catena = []
@@ -140,5 +139,5 @@ if __name__ == '__main__':
     plt.xlabel ('time  [h]')
     plt.ylabel ('rate [mm/h]')
     ax1.legend ()
-    plt.show ()        
+    ShowFigure (fig1, "simpleHillslope2CatenaResults.png")        
 
@@ -0,0 +1,242 @@
+"""
+
+@author: John Wainwright
+Streaming summaries of model output
+Rather than appending every timestep to lists and working through them at
+the end, a monitor reads one variable (soilMoist, overlandFlow, ...) of a
+cell, a set of cells or the outlets after each step and passes it to a set
+of reducers, each of which keeps only a running summary. Memory use is the
+same however long the run. Every reducer works on arrays, so one monitor
+can follow any number of cells at once, and works equally with a
+leakyBucket object, a cell view or a leakyBucketGrid. The reducers are:
+    runningTotal        total of rate times timestep (volume in mm) and the
+                        number of steps
+    peakValue           largest value, the time it happened and the time
+                        to peak from the start of monitoring
+    runoffCoefficient   total of the variable over total rainfall on the
+                        cells draining through the cell (contributingCells
+                        of them, so the coefficient of an outlet is for its
+                        whole catchment)
+    moments             mean, variance and skewness (updated with the
+                        method of Welford), minimum and maximum
+    hydrograph          means over bins of time, merged in pairs whenever
+                        maxPoints is reached so the number of points kept
+                        never grows beyond it
+
+Variables:
+    source              leakyBucket object, cell view or leakyBucketGrid
+    variable            name of the attribute followed, e.g. 'overlandFlow'
+    cells               cells followed in a grid (index, index array, e.g.
+                        network.outlets, or None for a single object)
+    reducers            reducers updated after each step
+    time                time in h recorded for the step (time * timestep
+                        in the drivers, as in their output)
+    timestep            length of step in hours
+    rainfall            rainfall rate in mm/h (scalar or one value per cell)
+    nSteps              number of steps a monitor has been stepped through
+                        (its reducers are saved in checkpoints, see
+                        checkpoint.py, so a restarted run can carry on
+                        with them)
+
+"""
+
+import numpy as np
+
+
+class runningTotal:
+    def __init__ (self):
+        self.total = 0.
+        self.nSteps = 0
+
+    def Update (self, time, value, timestep, rainfall):
+        self.total = self.total + value * timestep
+        self.nSteps = self.nSteps + 1
+
+    def Result (self):
+        return {'total': self.total, 'nSteps': self.nSteps}
+
+
+class peakValue:
+    def __init__ (self, initial = -np.inf):
+        self.peak = initial
+        self.timeOfPeak = 0.
+        self.startTime = None
+
+    def Update (self, time, value, timestep, rainfall):
+        if self.startTime is None:
+            self.startTime = time
+        higher = value > self.peak
+        self.peak = np.where (higher, value, self.peak)
+        self.timeOfPeak = np.where (higher, time, self.timeOfPeak)
+
+    def Result (self):
+        startTime = 0. if self.startTime is None else self.startTime
+        return {'peak': self.peak, 'timeOfPeak': self.timeOfPeak,
+                'timeToPeak': self.timeOfPeak - startTime}
+
+
+class runoffCoefficient:
+    def __init__ (self, contributingCells = 1.):
+        self.contributingCells = contributingCells
+        self.output = 0.
+        self.rainfall = 0.
+
+    def Update (self, time, value, timestep, rainfall):
+        self.output = self.output + value * timestep
+        self.rainfall = self.rainfall + (rainfall * self.contributingCells *
+                                         timestep)
+
+    def Result (self):
+        with np.errstate (divide = 'ignore', invalid = 'ignore'):
+            coefficient = np.where (np.asarray (self.rainfall) > 0.,
+                                    self.output / self.rainfall, np.nan)
+        return {'runoffCoefficient': coefficient, 'rainfall': self.rainfall}
+
+
+class moments:
+    def __init__ (self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.m3 = 0.
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def Update (self, time, value, timestep, rainfall):
+        n = self.n + 1
+        delta = value - self.mean
+        deltaN = delta / n
+        term = delta * deltaN * self.n
+        self.mean = self.mean + deltaN
+        self.m3 = self.m3 + term * deltaN * (n - 2) - 3. * deltaN * self.m2
+        self.m2 = self.m2 + term
+        self.n = n
+        self.minimum = np.minimum (self.minimum, value)
+        self.maximum = np.maximum (self.maximum, value)
+
+    def Result (self):
+        n = max (self.n, 1)
+        variance = self.m2 / n
+        with np.errstate (divide = 'ignore', invalid = 'ignore'):
+            skewness = np.where (np.asarray (variance) > 0.,
+                                 self.m3 / n / np.asarray (variance) ** 1.5,
+                                 0.)
+        return {'mean': self.mean, 'variance': variance,
+                'skewness': skewness, 'minimum': self.minimum,
+                'maximum': self.maximum}
+
+
+class hydrograph:
+    def __init__ (self, maxPoints = 1000, stepsPerPoint = 1):
+        #maxPoints is rounded up to an even number so bins can be merged in
+        #   pairs
+        self.maxPoints = maxPoints + maxPoints % 2
+        self.stepsPerPoint = stepsPerPoint
+        self.times = None
+        self.values = None
+        self.nPoints = 0
+        self.binTime = 0.
+        self.binTotal = 0.
+        self.binSteps = 0
+
+    def Update (self, time, value, timestep, rainfall):
+        if self.values is None:
+            value = np.asarray (value, dtype = float)
+            self.times = np.empty (self.maxPoints)
+            self.values = np.empty ((self.maxPoints,) + value.shape)
+        self.binTotal = self.binTotal + value
+        self.binTime = self.binTime + time
+        self.binSteps = self.binSteps + 1
+        if self.binSteps < self.stepsPerPoint:
+            return
+        if self.nPoints == self.maxPoints:
+            #merge neighbouring points and double the steps in each one
+            self.times [:self.maxPoints // 2] = 0.5 * (self.times [0::2] +
+                                                       self.times [1::2])
+            self.values [:self.maxPoints // 2] = 0.5 * (self.values [0::2] +
+                                                        self.values [1::2])
+            self.nPoints = self.maxPoints // 2
+            self.stepsPerPoint = 2 * self.stepsPerPoint
+            if self.binSteps < self.stepsPerPoint:
+                return
+        self.times [self.nPoints] = self.binTime / self.binSteps
+        self.values [self.nPoints] = self.binTotal / self.binSteps
+        self.nPoints = self.nPoints + 1
+        self.binTime = 0.
+        self.binTotal = 0.
+        self.binSteps = 0
+
+    def Result (self):
+        #mean times and values of the completed bins (a partly filled last
+        #   bin is left out)
+        if self.values is None:
+            return {'times': np.zeros (0), 'values': np.zeros (0),
+                    'stepsPerPoint': self.stepsPerPoint}
+        return {'times': self.times [:self.nPoints].copy (),
+                'values': self.values [:self.nPoints].copy (),
+                'stepsPerPoint': self.stepsPerPoint}
+
+
+class monitor:
+    def __init__ (self, source, variable, cells = None, reducers = None):
+        self.source = source
+        self.variable = variable
+        self.cells = cells
+        if reducers is None:
+            reducers = {'total': runningTotal (), 'peak': peakValue (),
+                        'moments': moments ()}
+        self.reducers = reducers
+        self.nSteps = 0
+
+    def Step (self, time, timestep, rainfall = 0.):
+        #pass the current values to every reducer
+        self.nSteps = self.nSteps + 1
+        value = getattr (self.source, self.variable)
+        if self.cells is not None:
+            value = value [self.cells]
+            rainfall = np.asarray (rainfall)
+            if rainfall.ndim > 0:
+                rainfall = rainfall [self.cells]
+        for reducer in self.reducers.values ():
+            reducer.Update (time, value, timestep, rainfall)
+
+    def Results (self):
+        return {name: reducer.Result ()
+                for name, reducer in self.reducers.items ()}
+
+if __name__ == '__main__':
+    from leakyBucket import leakyBucket
+
+    #the bottom cell of the simpleHillslope-2.py catena, summarised on the
+    #   fly and checked against the full series
+    catena = [leakyBucket (5., 0.04, 0.38, 10., 500., 5.) for cell in range (3)]
+    catena [1].upslopeCells.append (0)
+    catena [2].upslopeCells.append (1)
+    overlandFlow = monitor (catena [2], 'overlandFlow',
+                            reducers = {'total': runningTotal (),
+                                        'peak': peakValue (),
+                                        'runoffCoefficient':
+                                            runoffCoefficient (3.),
+                                        'moments': moments (),
+                                        'hydrograph': hydrograph (8)})
+    timestep = 1. / 60.
+    overlandFlowOut = []
+    for time in range (0, 60):
+        for thisSoil in catena:
+            runon = 0.
+            subsurfInflow = 0.
+            for upslope in thisSoil.upslopeCells:
+                runon = runon + catena [upslope].overlandFlow
+                subsurfInflow = subsurfInflow + catena [upslope].subsurfFlow
+            thisSoil.UpdateSoilMoist (20., runon, subsurfInflow, timestep)
+        overlandFlow.Step (time * timestep, timestep, 20.)
+        overlandFlowOut.append (catena [2].overlandFlow)
+    results = overlandFlow.Results ()
+    for name, result in results.items ():
+        print (name, result)
+    overlandFlowOut = np.array (overlandFlowOut)
+    print ('differences from the full series:',
+           results ['total'] ['total'] - overlandFlowOut.sum () * timestep,
+           results ['peak'] ['peak'] - overlandFlowOut.max (),
+           results ['moments'] ['mean'] - overlandFlowOut.mean (),
+           results ['moments'] ['variance'] - overlandFlowOut.var ())
@@ -0,0 +1,133 @@
+"""
+
+@author: John Wainwright
+Water-budget accounting for landscapes of leaky bucket cells
+When attached to a leakyBucketGrid (grid.budget = waterBudget (grid)) every
+update adds the volume of each flux into cumulative per-cell totals. The
+budget of each cell should close:
+    rain + runon + subsurfInflow - overlandFlow - subsurfFlow - drainage
+        = change in storage
+and any residual shows water gained or lost by the numerical scheme, for
+example when the saturation branch of the explicit update subtracts its
+excess from overland flow or when a dried-out bucket is reset to 1.e-6.
+Residuals are summarized every reportEvery timesteps. A timestep ends when
+UpdateSoilMoist is called for the whole grid; a loop that advances the
+cells one at a time through views (grid [i].UpdateSoilMoist) must call
+grid.EndStep (timestep) once every cell has been updated
+
+Variables:
+    grid                leakyBucketGrid being accounted for
+    reportEvery         number of timesteps between summaries (0 for none)
+    tolerance           largest absolute cell residual (mm) accepted before
+                        a summary counts the cell as failing
+    verbose             print each summary as it is made
+
+    cumulative volumes in mm (one value per cell)
+    rain                rainfall
+    runon               overland flow arriving from upslope
+    subsurfInflow       subsurface flow arriving from upslope
+    overlandFlow        overland flow leaving the cell
+    subsurfFlow         subsurface flow leaving the cell
+    drainage            drainage from the base of the soil profile
+    storageStart        storage in each cell when accounting started
+
+    variables describing the run
+    time                time accounted for in h
+    nSteps              number of timesteps accounted for
+    reports             list of summaries made every reportEvery timesteps
+
+"""
+
+import numpy as np
+
+fluxNames = ('rain', 'runon', 'subsurfInflow', 'overlandFlow', 'subsurfFlow',
+             'drainage')
+
+
+class waterBudget:
+    def __init__ (self, grid, reportEvery = 0, tolerance = 1.e-6,
+                  verbose = False):
+        self.grid = grid
+        self.reportEvery = reportEvery
+        self.tolerance = tolerance
+        self.verbose = verbose
+        self.Reset ()
+
+    def Reset (self):
+        #start accounting again from the current state of the grid
+        for name in fluxNames:
+            setattr (self, name, np.zeros (self.grid.nCells))
+        self.storageStart = self.grid.soilMoist.copy ()
+        self.time = 0.
+        self.nSteps = 0
+        self.reports = []
+
+    def Record (self, cells, rainfallRate, runonRate, subsurfInflow,
+                timestep):
+        #add the fluxes of one update of the selected cells (in double
+        #   precision, whatever the storage of the grid)
+        timestep = np.float64 (timestep)
+        self.rain [cells] += rainfallRate * timestep
+        self.runon [cells] += runonRate * timestep
+        self.subsurfInflow [cells] += subsurfInflow * timestep
+        self.overlandFlow [cells] += self.grid.overlandFlow [cells] * timestep
+        self.subsurfFlow [cells] += self.grid.subsurfFlow [cells] * timestep
+        self.drainage [cells] += self.grid.drainage [cells] * timestep
+
+    def EndStep (self, timestep):
+        #called once every cell has been advanced through a timestep
+        self.time = self.time + timestep
+        self.nSteps = self.nSteps + 1
+        if self.reportEvery and self.nSteps % self.reportEvery == 0:
+            report = self.Summary ()
+            self.reports.append (report)
+            if self.verbose:
+                print ('time {0} h: residual {1} mm, largest cell residual '
+                       '{2} mm, {3} cells outside tolerance'.format (
+                           report ['time'], report ['residual'],
+                           report ['maxCellResidual'], report ['nFailing']))
+
+    def Infiltration (self):
+        #water entering the soil surface of each cell
+        return self.rain + self.runon - self.overlandFlow
+
+    def StorageChange (self):
+        return self.grid.soilMoist - self.storageStart
+
+    def Residual (self):
+        #water unaccounted for in each cell (positive where water was lost)
+        return (self.rain + self.runon + self.subsurfInflow -
+                self.overlandFlow - self.subsurfFlow - self.drainage -
+                self.StorageChange ())
+
+    def Summary (self):
+        #landscape totals of every term along with the residuals
+        residual = self.Residual ()
+        report = {'time': self.time, 'nSteps': self.nSteps}
+        for name in fluxNames:
+            report [name] = float (getattr (self, name).sum ())
+        report ['infiltration'] = float (self.Infiltration ().sum ())
+        report ['storageChange'] = float (self.StorageChange ().sum ())
+        report ['residual'] = float (residual.sum ())
+        report ['maxCellResidual'] = float (np.abs (residual).max (initial = 0.))
+        report ['nFailing'] = int (np.count_nonzero (np.abs (residual) >
+                                                     self.tolerance))
+        return report
+
+if __name__ == '__main__':
+    from leakyBucketGrid import leakyBucketGrid
+    from routingNetwork import routingNetwork
+
+    #a three-cell catena on shallow soil with intense rain so the cells
+    #   saturate - the explicit update drifts, the adaptive one does not
+    for integrator in ('euler', 'adaptive'):
+        grid = leakyBucketGrid (3, 50., 0.04, 0.38, 10., 100., 5.)
+        grid.integrator = integrator
+        network = routingNetwork ([[], [0], [1]])
+        grid.budget = waterBudget (grid, reportEvery = 60)
+        for time in range (0, 600):
+            network.Route (grid, 80., 1. / 60.)
+        print (integrator)
+        for report in grid.budget.reports [::2]:
+            print ('  time', report ['time'], 'residual', report ['residual'],
+                   'cells outside tolerance', report ['nFailing'])